@@ -4,14 +4,14 @@ import base64
 import cv2
 import tempfile
 import json
-from flask import Flask, redirect, render_template, request, session
+from flask import Flask, jsonify, redirect, render_template, request, session
 from flask_session import Session
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from cs50 import SQL
 from helpers import apology, create_database, login_required, zip_filenames, format_name, generate_title_slice, normalize, get_patient_images
-from model import predict
-from threed import load_images_from_folder, threed_render
+from model import predict, registry, resolve_backend, BACKEND_MODELS, InferenceConfig
+from threed import threed_render_progressive, read_status, parse_spacing, new_label_volume
 
 
 # configure app
@@ -24,6 +24,9 @@ Session(app)
 
 create_database()
 
+# load and warm up both networks once per worker instead of on every /model request
+registry.warm_up(BACKEND_MODELS[resolve_backend(InferenceConfig.BACKEND)])
+
 # use CS50 built in Library to connect to database via sqlite
 # (handles messy sqlachemy connection openings/closures for you)
 db = SQL("sqlite:///dats.db")
@@ -140,8 +143,8 @@ def upload():
 def model():
     # retrieve image paths from session, declare device, checkpoint and model
     image_paths = session.get('image_paths', [])
-    # predict!!
-    overlay_image_paths = predict(image_paths)
+    # predict!! (the labels go straight into the label volume of the 3D rendering, a scratch file by default)
+    overlay_image_paths, label_volume = predict(image_paths, allocate=new_label_volume)
     session['overlay_paths'] = overlay_image_paths
     
     predictions = []
@@ -167,13 +170,24 @@ def model():
     # save path to session
     session['obj_path'] = os.path.splitext(static_filename)[0]
 
-    # load masks from folder, then create 3D model
-    images = load_images_from_folder(app.config['MASKS_FOLDER'], prefix)
-    threed_render(images, combined_filename, organ_colors)
+    # create 3D model from the predicted label volume, resampled with the voxel spacing of the slices:
+    # a quick preview now, the full-quality meshes in the background (see /model/status)
+    spacing = parse_spacing(image_paths[0]) if image_paths else None
+    threed_render_progressive(label_volume, combined_filename, organ_colors, spacing, owned=True)
 
     return render_template("model.html", predictions=predictions, image_paths=image_paths)
 
 
+# state of the full-quality 3D model of a rendering, polled by the render page while it shows the preview
+@app.route("/model/status")
+@login_required
+def model_status():
+    # only the file name of the rendering, the folder is always the objs folder
+    name = os.path.basename(request.args.get('name', ''))
+    status = read_status(os.path.join(app.config['OBJS_FOLDER'], f'{name}.obj')) if name else None
+    return jsonify(status=status['status'] if status else 'ready')
+
+
 # route for displaying overlaid image carousel and 3D model 
 @app.route("/render")
 @login_required
@@ -0,0 +1,68 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+# dynamic micro-batching: items submitted from any number of threads are collected into batches of at
+# most `max_batch_size`, waiting no longer than `max_wait` seconds after the first item of a batch arrived.
+# each batch goes through `process_fn(items) -> results` on a single worker thread, and every caller gets
+# its own result back through a Future.
+class MicroBatcher:
+    def __init__(self, process_fn, max_batch_size=32, max_wait=0.005, name='micro-batcher'):
+        self.process_fn = process_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.name = name
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        # simple counters, handy to check how well requests get merged
+        self.num_batches = 0
+        self.num_items = 0
+
+    # start the worker thread on first use
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, item):
+        future = Future()
+        self._ensure_started()
+        self._queue.put((item, future))
+        return future
+
+    def submit_many(self, items):
+        return [self.submit(item) for item in items]
+
+    # block until the next batch is ready: the first item, then whatever arrives before the deadline
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            # callers that gave up (cancelled futures) don't need to be computed
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                results = self.process_fn([item for item, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            self.num_batches += 1
+            self.num_items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
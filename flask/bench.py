@@ -0,0 +1,314 @@
+# Benchmarks for the serving path. Run from the flask folder:
+#   python bench.py startup      -- worker start-up time and memory, with and without tensorflow
+#   python bench.py resample     -- time and mesh quality of the volume resampling methods of threed.py
+#   python bench.py closing      -- time and voxel agreement of the closing methods of threed.py
+#   python bench.py memory       -- peak memory of every step of threed_render over longer and longer studies
+#   python bench.py prune        -- voxels and triangles removed by the fragment pruning of threed.py
+import os
+import sys
+import json
+import time
+import subprocess
+import numpy as np
+
+
+# child process: import the serving code, load and warm the models of one backend, report time and memory
+STARTUP_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import model
+imported = time.perf_counter()
+backend = sys.argv[1]
+model.registry.warm_up(model.BACKEND_MODELS[backend])
+warm = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - start,
+    'warm_up_s': warm - imported,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+    'tensorflow_loaded': 'tensorflow' in sys.modules,
+}))
+"""
+
+
+# start-up time and peak resident memory of a fresh worker for each backend (each in its own process)
+def bench_startup(backends=('keras', 'torch')):
+    results = {}
+    for backend in backends:
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT, backend], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        if output.returncode != 0:
+            print(f"{backend}: failed\n{output.stderr}")
+            continue
+        results[backend] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    print(f"{'backend':<8} {'import (s)':>10} {'warm-up (s)':>11} {'max RSS (MB)':>12}  tensorflow")
+    for backend, result in results.items():
+        print(f"{backend:<8} {result['import_s']:>10.2f} {result['warm_up_s']:>11.2f} {result['max_rss_mb']:>12.0f}  "
+              f"{'loaded' if result['tensorflow_loaded'] else 'not loaded'}")
+    return results
+
+
+# organ colors of the masks written by the app (organ_colors in app.py)
+MASK_COLORS = [[249, 187, 191], [254, 128, 162], [183, 82, 100]]
+
+# synthetic organs: (center, radii) in mm along (row, column, slice)
+SYNTHETIC_ORGANS = [((150.0, 135.0, 90.0), (45.0, 37.0, 24.0)),
+                    ((225.0, 240.0, 135.0), (30.0, 52.0, 36.0)),
+                    ((180.0, 300.0, 150.0), (37.0, 22.0, 45.0))]
+
+
+# (slices, H, W) label volume of ellipsoid organs sampled at the given spacing, built slice by slice
+# (into `out` when given, e.g. a scratch volume)
+def synthetic_study(spacing=(1.5, 1.5, 3.0), shape=(80, 266, 266), out=None):
+    yy, xx = np.meshgrid(np.arange(shape[1]) * spacing[0], np.arange(shape[2]) * spacing[1], indexing='ij')
+    label_volume = out if out is not None else np.zeros(shape, dtype=np.uint8)
+    for idx in range(shape[0]):
+        for class_id, (center, radii) in enumerate(SYNTHETIC_ORGANS, start=1):
+            inside = (((yy - center[0]) / radii[0]) ** 2 + ((xx - center[1]) / radii[1]) ** 2
+                      + ((idx * spacing[2] - center[2]) / radii[2]) ** 2) <= 1
+            label_volume[idx][inside] = class_id
+    return label_volume
+
+
+# the synthetic study with `num_fragments` small specks of every organ scattered around, like segmentation noise
+def noisy_study(spacing=(1.5, 1.5, 3.0), shape=(80, 266, 266), num_fragments=300, seed=0):
+    label_volume = synthetic_study(spacing, shape)
+    rng = np.random.default_rng(seed)
+    for class_id in range(1, len(SYNTHETIC_ORGANS) + 1):
+        corners = rng.integers(0, np.array(shape) - 3, size=(num_fragments, 3))
+        sizes = rng.integers(1, 4, size=(num_fragments, 3))
+        for (z, y, x), (dz, dy, dx) in zip(corners, sizes):
+            region = label_volume[z:z + dz, y:y + dy, x:x + dx]
+            region[region == 0] = class_id
+    return label_volume
+
+
+# the synthetic organ rasterized straight on the resampled grid of a roi: what a perfect resampling gives
+def synthetic_truth(roi, class_id, spacing):
+    center, radii = SYNTHETIC_ORGANS[class_id - 1]
+    axes = [(np.arange(start, stop) * step * sp - c0) / r
+            for start, stop, step, sp, c0, r in zip(roi.out_start, roi.out_stop, roi.step, spacing, center, radii)]
+    yy, xx, zz = np.meshgrid(*axes, indexing='ij')
+    return yy ** 2 + xx ** 2 + zz ** 2 <= 1
+
+
+# label volume and voxel spacing of a study: predicted masks from a folder, or the synthetic organs
+def load_study(masks_dir=None, prefix=None, spacing=None):
+    from threed import MeshConfig, load_images_from_folder, build_label_volume, scale_factors
+
+    config = MeshConfig()
+    spacing = tuple(spacing or (config.PIXEL_SPACING, config.PIXEL_SPACING, config.SLICE_THICKNESS))
+    if masks_dir:
+        label_volume = build_label_volume(load_images_from_folder(masks_dir, prefix), MASK_COLORS)
+    else:
+        label_volume = synthetic_study(spacing)
+    print(f"{label_volume.shape[0]} slices of {label_volume.shape[1]}x{label_volume.shape[2]}, spacing {spacing} mm, "
+          f"zoom {tuple(round(float(f), 2) for f in scale_factors(spacing))}")
+    return label_volume, spacing
+
+
+def dice(a, b):
+    total = a.sum() + b.sum()
+    return 2.0 * np.logical_and(a, b).sum() / total if total else 1.0
+
+
+# resampling (+ closing and marching cubes, as in threed_render) of every organ with each method:
+# median time, triangles, surface area and Dice of the closed volume against a reference -- the exact
+# shapes for the synthetic study, the original cubic zoom of the booleans for real masks
+def bench_resample(masks_dir=None, prefix=None, spacing=None, repeats=3):
+    from skimage import measure
+    from threed import MeshConfig, resample_organ, close_volume, mesh_volume
+
+    label_volume, spacing = load_study(masks_dir, prefix, spacing)
+    iso_spacing = min(spacing)
+
+    methods = [('spline', 3), ('spline', 1), ('smooth', 1), ('sdf', 1)]
+    results, references = {}, {}
+    for method, order in methods:
+        method_config = MeshConfig(RESAMPLE_METHOD=method, RESAMPLE_ORDER=order)
+        times, faces, area, dices = [], 0, 0.0, []
+        for class_id in range(1, len(MASK_COLORS) + 1):
+            if not (label_volume == class_id).any():
+                continue
+            organ_times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                roi, volume = resample_organ(label_volume, class_id, spacing, method_config)
+                volume = close_volume(volume, iso_spacing, method_config)
+                verts, organ_faces = mesh_volume(volume, roi.offset)
+                organ_times.append(time.perf_counter() - start)
+            times.append(np.median(organ_times))
+            faces += len(organ_faces)
+            area += measure.mesh_surface_area(verts, organ_faces) * iso_spacing ** 2
+            if masks_dir:
+                reference = references.setdefault(class_id, volume)
+            else:
+                reference = synthetic_truth(roi, class_id, spacing)
+            dices.append(dice(volume, reference))
+        results[f'{method}/{order}'] = {'time_s': float(np.sum(times)), 'faces': faces, 'area_mm2': float(area),
+                                        'dice': float(np.mean(dices))}
+
+    reference_name = 'spline/3' if masks_dir else 'exact shapes'
+    print(f"{'method':<10} {'time (s)':>9} {'triangles':>10} {'area (cm2)':>11} {'Dice vs ' + reference_name:>22}")
+    for name, result in results.items():
+        print(f"{name:<10} {result['time_s']:>9.3f} {result['faces']:>10} {result['area_mm2'] / 100:>11.1f} "
+              f"{result['dice']:>22.4f}")
+    return results
+
+
+# closing of every resampled organ with each method and radius (mm): median time, and agreement with
+# binary_closing() and a ball, voxel for voxel
+def bench_closing(masks_dir=None, prefix=None, spacing=None, radii=(3.0, 4.5, 7.5), repeats=3):
+    from threed import MeshConfig, resample_organ, close_volume
+
+    label_volume, spacing = load_study(masks_dir, prefix, spacing)
+    iso_spacing = min(spacing)
+    volumes = [resample_organ(label_volume, class_id, spacing)[1]
+               for class_id in range(1, len(MASK_COLORS) + 1) if (label_volume == class_id).any()]
+    print(f"{len(volumes)} organs, {sum(volume.size for volume in volumes) / 1e6:.1f} M resampled voxels")
+
+    print(f"{'radius (mm)':>11} {'method':<10} {'time (s)':>9} {'speedup':>8} {'differing voxels':>17}")
+    results = {}
+    for radius in radii:
+        references, ball_time = None, None
+        for method in ('ball', 'separable', 'edt'):
+            config = MeshConfig(CLOSING_RADIUS=radius, CLOSING_METHOD=method)
+            elapsed, closed = 0.0, []
+            for volume in volumes:
+                times = []
+                for _ in range(repeats):
+                    start = time.perf_counter()
+                    result = close_volume(volume, iso_spacing, config)
+                    times.append(time.perf_counter() - start)
+                elapsed += np.median(times)
+                closed.append(result)
+            references = references or closed
+            ball_time = ball_time or elapsed
+            differing = sum(int(np.sum(a != b)) for a, b in zip(closed, references))
+            results[(radius, method)] = {'time_s': float(elapsed), 'differing_voxels': differing}
+            print(f"{radius:>11.1f} {method:<10} {elapsed:>9.3f} {ball_time / elapsed:>7.1f}x {differing:>17}")
+    return results
+
+
+# child process: render a synthetic study of a given number of slices (in RAM or in a scratch file) and
+# report the peak memory of every step of threed_render
+MEMORY_SCRIPT = """
+import json, os, sys, tempfile
+import bench, threed
+num_slices, out_of_core = int(sys.argv[1]), sys.argv[2] == '1'
+# no .obj.gz: it is written in the background, after the folder is gone
+config = threed.MeshConfig(OUT_OF_CORE=out_of_core, SLAB_CACHE=False, OBJ_GZIP_LEVEL=0)
+shape = (num_slices, 266, 266)
+with tempfile.TemporaryDirectory() as folder, threed.MemoryReport() as report:
+    with threed.memory_stage('label volume'):
+        label_volume = threed.scratch_volume(shape) if out_of_core else None
+        label_volume = bench.synthetic_study(shape=shape, out=label_volume)
+    threed.threed_render(label_volume, os.path.join(folder, 'study.obj'), bench.MASK_COLORS, config=config)
+if out_of_core:
+    os.remove(label_volume.filename)
+print(json.dumps(report.peaks))
+"""
+
+
+# fragment pruning with each minimum volume (mm3): fragments and voxels removed, triangles of the meshes and the
+# time spent pruning and meshing (a minimum volume of 0 meshes the study as it is). the synthetic organs get
+# scattered specks of noise (see noisy_study).
+def bench_prune(masks_dir=None, prefix=None, spacing=None, min_volumes=(0.0, 50.0, 100.0, 250.0), keep_largest=0):
+    import threed
+    from threed import MeshConfig, mesh_organs, prune_components
+
+    if masks_dir:
+        label_volume, spacing = load_study(masks_dir, prefix, spacing)
+    else:
+        spacing = tuple(spacing or (1.5, 1.5, 3.0))
+        label_volume = noisy_study(spacing)
+    num_organs = len(MASK_COLORS)
+
+    print(f"{'min (mm3)':>9} {'fragments removed':>17} {'voxels removed':>14} {'triangles':>10} {'removed':>8} "
+          f"{'prune (s)':>9} {'mesh (s)':>8}")
+    results, baseline = {}, None
+    for min_volume in min_volumes:
+        config = MeshConfig(PRUNE_MIN_VOLUME=min_volume, PRUNE_KEEP_LARGEST=keep_largest, SLAB_CACHE=False)
+        volume = label_volume.copy()
+        start = time.perf_counter()
+        pruned = prune_components(volume, num_organs, spacing, config) if min_volume else []
+        prune_time = time.perf_counter() - start
+        start = time.perf_counter()
+        meshes = mesh_organs(volume, num_organs, spacing, config, workers=threed.MESH_WORKERS)
+        mesh_time = time.perf_counter() - start
+        triangles = sum(len(faces) for _, faces in meshes)
+        baseline = baseline if baseline is not None else triangles
+        removed = sum(num_removed for _, num_removed, _ in pruned)
+        voxels = sum(num_voxels for _, _, num_voxels in pruned)
+        results[min_volume] = {'fragments_removed': removed, 'voxels_removed': voxels, 'triangles': triangles,
+                               'prune_s': prune_time, 'mesh_s': mesh_time}
+        print(f"{min_volume:>9.0f} {removed:>17} {voxels:>14} {triangles:>10} {baseline - triangles:>8} "
+              f"{prune_time:>9.3f} {mesh_time:>8.3f}")
+    return results
+
+
+# peak memory (traced allocations, numpy arrays included) of every step of threed_render on synthetic studies of
+# more and more slices, with the label volume in RAM and in a memory-mapped scratch file. each run is a fresh process.
+def bench_memory(num_slices=(80, 160, 320, 640)):
+    results = {}
+    for out_of_core in (False, True):
+        for count in num_slices:
+            output = subprocess.run([sys.executable, '-c', MEMORY_SCRIPT, str(count), str(int(out_of_core))],
+                                    capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            if output.returncode != 0:
+                print(f"{count} slices: failed\n{output.stderr}")
+                continue
+            results[(out_of_core, count)] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    steps = list(dict.fromkeys(step for peaks in results.values() for step in peaks))
+    print(f"{'label volume':<13} {'slices':>6} " + ' '.join(f'{step:>14}' for step in steps) + "   (peak MB)")
+    for (out_of_core, count), peaks in results.items():
+        print(f"{'memory-mapped' if out_of_core else 'in RAM':<13} {count:>6} "
+              + ' '.join(f"{peaks.get(step, 0) / 2 ** 20:>14.1f}" for step in steps))
+    return results
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    # Define the benchmarks and their parameters
+    startup = subparsers.add_parser("startup", help="Worker start-up time and memory for each backend")
+    startup.add_argument("-backends", nargs="+", default=['keras', 'torch'], help="Backends to compare (default: keras torch)")
+
+    resample = subparsers.add_parser("resample", help="Time and mesh quality of the resampling methods")
+    resample.add_argument("-masks_dir", type=str, default=None, help="Folder of predicted masks (default: synthetic organs)")
+    resample.add_argument("-prefix", type=str, default=None, help="Study prefix of the masks, as in app.py: case<n>_day<n>_<user id>")
+    resample.add_argument("-spacing", type=float, nargs=3, default=None, help="Voxel spacing (row, column, slice) in mm (default 1.5 1.5 3.0)")
+    resample.add_argument("-repeats", type=int, default=3, help="Timed runs per organ (default 3)")
+
+    closing = subparsers.add_parser("closing", help="Time and voxel agreement of the closing methods")
+    closing.add_argument("-masks_dir", type=str, default=None, help="Folder of predicted masks (default: synthetic organs)")
+    closing.add_argument("-prefix", type=str, default=None, help="Study prefix of the masks, as in app.py: case<n>_day<n>_<user id>")
+    closing.add_argument("-spacing", type=float, nargs=3, default=None, help="Voxel spacing (row, column, slice) in mm (default 1.5 1.5 3.0)")
+    closing.add_argument("-radii", type=float, nargs="+", default=[3.0, 4.5, 7.5], help="Closing radii in mm (default 3.0 4.5 7.5)")
+    closing.add_argument("-repeats", type=int, default=3, help="Timed runs per organ (default 3)")
+
+    memory = subparsers.add_parser("memory", help="Peak memory of every step of the mesh build against the study length")
+    memory.add_argument("-num_slices", type=int, nargs="+", default=[80, 160, 320, 640], help="Study lengths (default 80 160 320 640)")
+
+    prune = subparsers.add_parser("prune", help="Voxels and triangles removed by the fragment pruning")
+    prune.add_argument("-masks_dir", type=str, default=None, help="Folder of predicted masks (default: synthetic organs with noise)")
+    prune.add_argument("-prefix", type=str, default=None, help="Study prefix of the masks, as in app.py: case<n>_day<n>_<user id>")
+    prune.add_argument("-spacing", type=float, nargs=3, default=None, help="Voxel spacing (row, column, slice) in mm (default 1.5 1.5 3.0)")
+    prune.add_argument("-min_volumes", type=float, nargs="+", default=[0.0, 50.0, 100.0, 250.0], help="Minimum fragment volumes in mm3 (default 0 50 100 250)")
+    prune.add_argument("-keep_largest", type=int, default=0, help="Also keep only the N largest fragments of every organ (default 0: no limit)")
+
+    args = parser.parse_args()
+    if args.benchmark == "startup":
+        bench_startup(args.backends)
+    elif args.benchmark == "resample":
+        bench_resample(args.masks_dir, args.prefix, args.spacing, args.repeats)
+    elif args.benchmark == "closing":
+        bench_closing(args.masks_dir, args.prefix, args.spacing, args.radii, args.repeats)
+    elif args.benchmark == "prune":
+        bench_prune(args.masks_dir, args.prefix, args.spacing, args.min_volumes, args.keep_largest)
+    elif args.benchmark == "memory":
+        bench_memory(args.num_slices)
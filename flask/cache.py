@@ -0,0 +1,150 @@
+import os
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from dataclasses import dataclass
+
+
+# class for the inference result cache configuration
+@dataclass
+class CacheConfig:
+    ENABLED: bool = True
+    PATH: str = 'static/uploads/inference_cache.db'
+    MAX_BYTES: int = 256 * 1024 * 1024  # size cap of the stored masks, least recently used entries go first
+    MESH_PATH: str = 'static/uploads/mesh_cache.db'
+    MESH_MAX_BYTES: int = 512 * 1024 * 1024  # size cap of the stored slab meshes
+
+
+# cache key of a slice: hash of the normalized png (as written by /upload) and of everything the result
+# depends on (model versions, inference settings), so a new checkpoint never serves stale masks
+def slice_key(file_path, model_version):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(file_path, 'rb') as f:
+        digest.update(f.read())
+    digest.update(model_version.encode())
+    return digest.hexdigest()
+
+
+# persistent LRU cache in one SQLite table: every row has a key, the values of the subclass (COLUMNS), its size
+# in bytes and the time it was last used, refreshed on every hit. once the sizes add up to more than max_bytes,
+# the least recently used rows go first. subclasses turn their entries into rows and back.
+class SQLiteLRUCache:
+    TABLE = None
+    COLUMNS = ()
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        columns = ', '.join(('key TEXT PRIMARY KEY',) + tuple(self.COLUMNS) +
+                            ('size INTEGER NOT NULL', 'last_used REAL NOT NULL'))
+        self._conn.execute(f'CREATE TABLE IF NOT EXISTS {self.TABLE} ({columns})')
+        self._conn.execute(f'CREATE INDEX IF NOT EXISTS {self.TABLE}_last_used ON {self.TABLE} (last_used)')
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    # the (key, *values) rows of the keys found, marked as just used
+    def _get_rows(self, keys):
+        keys = list(keys)
+        if not keys:
+            return []
+        names = ', '.join(['key'] + [column.split()[0] for column in self.COLUMNS])
+        with self._lock:
+            placeholders = ','.join('?' * len(keys))
+            rows = self._conn.execute(
+                f'SELECT {names} FROM {self.TABLE} WHERE key IN ({placeholders})', keys).fetchall()
+            now = time.time()
+            self._conn.executemany(f'UPDATE {self.TABLE} SET last_used = ? WHERE key = ?',
+                                   [(now, row[0]) for row in rows])
+            self._conn.commit()
+        self.hits += len(rows)
+        self.misses += len(keys) - len(rows)
+        return rows
+
+    # store (key, *values, size) rows, then evict down to the size cap
+    def _put_rows(self, rows):
+        now = time.time()
+        rows = [tuple(row) + (now,) for row in rows]
+        if not rows:
+            return
+        placeholders = ', '.join('?' * len(rows[0]))
+        with self._lock:
+            self._conn.executemany(f'INSERT OR REPLACE INTO {self.TABLE} VALUES ({placeholders})', rows)
+            self._evict()
+            self._conn.commit()
+
+    # drop least recently used rows until their sizes add up to at most max_bytes
+    def _evict(self):
+        total = self._conn.execute(f'SELECT COALESCE(SUM(size), 0) FROM {self.TABLE}').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        freed = 0
+        to_delete = []
+        for key, size in self._conn.execute(f'SELECT key, size FROM {self.TABLE} ORDER BY last_used ASC'):
+            if total - freed <= self.max_bytes:
+                break
+            to_delete.append((key,))
+            freed += size
+        self._conn.executemany(f'DELETE FROM {self.TABLE} WHERE key = ?', to_delete)
+
+
+# persistent LRU cache of per-slice inference results (classifier score + label mask).
+# masks are stored as zlib-compressed uint8 label maps: mostly background, so a few hundred bytes each.
+class ResultCache(SQLiteLRUCache):
+    TABLE = 'results'
+    COLUMNS = ('score REAL NOT NULL', 'height INTEGER NOT NULL', 'width INTEGER NOT NULL', 'labels BLOB NOT NULL')
+
+    def __init__(self, path=CacheConfig.PATH, max_bytes=CacheConfig.MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    # look up many keys at once, returns {key: (score, labels)} for the ones found
+    def get_many(self, keys):
+        found = {}
+        for key, score, height, width, blob in self._get_rows(keys):
+            labels = np.frombuffer(zlib.decompress(blob), dtype=np.uint8).reshape(height, width)
+            found[key] = (score, labels)
+        return found
+
+    # store many (key, score, labels) results, then evict down to the size cap
+    def put_many(self, items):
+        rows = []
+        for key, score, labels in items:
+            blob = zlib.compress(np.ascontiguousarray(labels, dtype=np.uint8).tobytes(), 1)
+            rows.append((key, float(score), labels.shape[0], labels.shape[1], blob, len(blob)))
+        self._put_rows(rows)
+
+
+# persistent LRU cache of the meshes of volume slabs (see threed.mesh_organs), keyed by a hash of the slab
+# labels and of the meshing settings. vertices and faces are stored zlib-compressed, as float32 and int32.
+class MeshCache(SQLiteLRUCache):
+    TABLE = 'meshes'
+    COLUMNS = ('num_vertices INTEGER NOT NULL', 'mesh BLOB NOT NULL')
+
+    def __init__(self, path=CacheConfig.MESH_PATH, max_bytes=CacheConfig.MESH_MAX_BYTES):
+        super().__init__(path, max_bytes)
+
+    # look up many keys at once, returns {key: (vertices, faces)} for the ones found
+    def get_many(self, keys):
+        found = {}
+        for key, num_vertices, blob in self._get_rows(keys):
+            data = zlib.decompress(blob)
+            vertices = np.frombuffer(data, dtype=np.float32, count=3 * num_vertices).reshape(-1, 3)
+            faces = np.frombuffer(data, dtype=np.int32, offset=vertices.nbytes).reshape(-1, 3)
+            found[key] = (vertices.copy(), faces.copy())
+        return found
+
+    # store many (key, vertices, faces) meshes, then evict down to the size cap
+    def put_many(self, items):
+        rows = []
+        for key, vertices, faces in items:
+            vertices = np.ascontiguousarray(vertices, dtype=np.float32)
+            data = vertices.tobytes() + np.ascontiguousarray(faces, dtype=np.int32).tobytes()
+            blob = zlib.compress(data, 1)
+            rows.append((key, len(vertices), blob, len(blob)))
+        self._put_rows(rows)
@@ -0,0 +1,143 @@
+import numpy as np
+from scipy.sparse import coo_matrix
+
+
+# quadric of every face plane (area weighted), as the 10 coefficients of the symmetric 4x4 matrix
+# [a², ab, ac, ad, b², bc, bd, c², cd, d²] of the plane ax + by + cz + d = 0
+QUADRIC_INDEX = [(0, 0), (0, 1), (0, 2), (0, 3), (1, 1), (1, 2), (1, 3), (2, 2), (2, 3), (3, 3)]
+
+
+# unique rows of a (n, k) array of non-negative integers below `size`, with the index of every row in them:
+# through a single int64 key per row when it fits, which sorts much faster than rows
+def unique_rows(rows, size, return_index=False):
+    if float(size) ** rows.shape[1] < 2 ** 63:
+        keys = np.zeros(len(rows), dtype=np.int64)
+        for column in rows.T:
+            keys = keys * size + column
+        return np.unique(keys, return_index=return_index, return_inverse=True)
+    return np.unique(rows, axis=0, return_index=return_index, return_inverse=True)
+
+
+def face_quadrics(vertices, faces):
+    corners = vertices[faces].astype(np.float64)
+    cross = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    double_area = np.linalg.norm(cross, axis=1)
+    normals = cross / np.maximum(double_area, 1e-12)[:, None]
+    planes = np.column_stack([normals, -np.einsum('ij,ij->i', normals, corners[:, 0])])
+    weights = 0.5 * double_area
+    return np.column_stack([weights * planes[:, i] * planes[:, j] for i, j in QUADRIC_INDEX])
+
+
+# position minimizing the summed quadric of every cluster, pulled slightly towards the mean of its vertices
+# so flat or thin clusters (singular quadrics) stay put
+def _cluster_positions(quadrics, means):
+    q = quadrics
+    a = np.stack([np.stack([q[:, 0], q[:, 1], q[:, 2]], -1),
+                  np.stack([q[:, 1], q[:, 4], q[:, 5]], -1),
+                  np.stack([q[:, 2], q[:, 5], q[:, 7]], -1)], axis=1)
+    b = -np.column_stack([q[:, 3], q[:, 6], q[:, 8]])
+    regularization = 1e-3 * (q[:, 0] + q[:, 4] + q[:, 7])[:, None, None] / 3 + 1e-9
+    a = a + regularization * np.eye(3)
+    b = b + regularization[:, :, 0] * means
+    return np.linalg.solve(a, b[..., None])[..., 0]
+
+
+# vertex clustering on a grid of `cell` (mesh units): every vertex of a cell merges into one, placed where the
+# summed quadrics of its faces are smallest (Lindstrom's out-of-core simplification). faces collapsing to an
+# edge or a point, and repeated faces, are dropped.
+def cluster_vertices(vertices, faces, cell):
+    cells = np.floor((vertices - vertices.min(axis=0)) / cell).astype(np.int64)
+    _, cluster = unique_rows(cells, int(cells.max()) + 1)
+    cluster = cluster.reshape(-1)
+    counts = np.bincount(cluster)
+    num_clusters = len(counts)
+
+    means = np.column_stack([np.bincount(cluster, vertices[:, i], num_clusters) for i in range(3)]) / counts[:, None]
+    quadrics = face_quadrics(vertices, faces)
+    # every face adds its quadric to the clusters of its three corners
+    corner_clusters = cluster[faces].reshape(-1)
+    summed = np.column_stack([np.bincount(corner_clusters, np.repeat(quadrics[:, k], 3), num_clusters)
+                              for k in range(quadrics.shape[1])])
+    positions = _cluster_positions(summed, means)
+    # keep every vertex within its cell (and a little around it), a bad quadric can't throw it away
+    lower = np.floor(means / cell) * cell
+    positions = np.clip(positions, np.minimum(lower - 0.5 * cell, means), np.maximum(lower + 1.5 * cell, means))
+
+    new_faces = cluster[faces]
+    keep = ((new_faces[:, 0] != new_faces[:, 1]) & (new_faces[:, 1] != new_faces[:, 2])
+            & (new_faces[:, 0] != new_faces[:, 2]))
+    new_faces = new_faces[keep]
+    # the same triangle can come out of several faces (whatever its winding)
+    _, unique_idx, _ = unique_rows(np.sort(new_faces, axis=1), num_clusters, return_index=True)
+    new_faces = new_faces[np.sort(unique_idx)]
+
+    used = np.zeros(num_clusters, dtype=bool)
+    used[new_faces] = True
+    new_index = np.cumsum(used) - 1
+    return positions[used].astype(vertices.dtype), new_index[new_faces].astype(np.int32)
+
+
+def surface_area(vertices, faces):
+    corners = vertices[faces].astype(np.float64)
+    return 0.5 * np.linalg.norm(np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0]), axis=1).sum()
+
+
+# vertex clustering down to about `target` triangles: a grid cell of area ~ 2 * surface / target to begin
+# with, then rescaled by the square root of the miss a few times
+def decimate_clustering(vertices, faces, target, tolerance=0.1, max_iterations=6):
+    cell = np.sqrt(2.0 * surface_area(vertices, faces) / target)
+    best = None
+    for _ in range(max_iterations):
+        simplified = cluster_vertices(vertices, faces, cell)
+        num_faces = len(simplified[1])
+        if num_faces <= target * (1 + tolerance) and (best is None or num_faces > len(best[1])):
+            best = simplified
+        if abs(num_faces - target) <= tolerance * target or num_faces == 0:
+            break
+        cell *= np.sqrt(max(num_faces, 1) / target)
+    return best if best is not None else simplified
+
+
+# quadric-error simplification down to about `target` triangles: fast_simplification (edge collapses) when it
+# is installed, vertex clustering with the same error metric otherwise
+def simplify_mesh(vertices, faces, target):
+    if len(faces) <= target:
+        return vertices, faces
+    try:
+        import fast_simplification
+    except ImportError:
+        return decimate_clustering(vertices, faces, target)
+    points, triangles = fast_simplification.simplify(vertices.astype(np.float32), faces.astype(np.int32),
+                                                     target_reduction=1.0 - target / len(faces))
+    return points.astype(vertices.dtype), triangles.astype(np.int32)
+
+
+# Taubin smoothing: a shrinking umbrella step (lambda) followed by an inflating one (mu) every iteration,
+# which smooths the stair steps out without the shrinkage of plain laplacian smoothing
+def taubin_smooth(vertices, faces, iterations=10, lam=0.5, mu=-0.53):
+    if iterations <= 0 or len(faces) == 0:
+        return vertices
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.sort(edges, axis=1)
+    edges = edges[unique_rows(edges, len(vertices), return_index=True)[1]]
+    rows, cols = np.concatenate([edges[:, 0], edges[:, 1]]), np.concatenate([edges[:, 1], edges[:, 0]])
+    adjacency = coo_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(vertices),) * 2).tocsr()
+    degree = np.maximum(np.asarray(adjacency.sum(axis=1)), 1)
+    smoothed = vertices.astype(np.float64)
+    for _ in range(iterations):
+        for factor in (lam, mu):
+            smoothed += factor * (adjacency @ smoothed / degree - smoothed)
+    return smoothed.astype(vertices.dtype)
+
+
+# levels of detail of one mesh, one per triangle budget (finest first). a mesh already within a budget is kept
+# as it is for that level.
+def mesh_lods(vertices, faces, budgets, smoothing=0):
+    levels = []
+    for budget in sorted(budgets, reverse=True):
+        if len(faces) <= budget:
+            levels.append((vertices, faces))
+            continue
+        lod_vertices, lod_faces = simplify_mesh(vertices, faces, budget)
+        levels.append((taubin_smooth(lod_vertices, lod_faces, smoothing), lod_faces))
+    return levels
@@ -0,0 +1,126 @@
+# Export the Lightning SegFormer checkpoint and the keras slice classifier to ONNX,
+# then check that onnx runtime reproduces the eager outputs.
+# Run from the flask folder: python export_onnx.py [-images_dir <folder of slices>]
+import os
+import glob
+import json
+import numpy as np
+import torch
+
+from model import (DatasetConfig, CKPT_PATH, CLASS_MODEL_PATH, SEG_ONNX_PATH, CLASS_ONNX_PATH, ONNX_REPORT_PATH,
+                   file_hash, load_segmentation_model, load_class_model, load_slices, normalize_classif_batch,
+                   normalize_segmentation_batch)
+
+
+# export the segmentation model (SegFormer, raw logits: segment_images() upsamples them) with a dynamic batch axis
+def export_segmentation(ckpt_path, onnx_path, opset=17):
+    model = load_segmentation_model(ckpt_path, torch.device("cpu"))
+    width, height = DatasetConfig.IMAGE_SIZE
+    dummy = torch.zeros((1, 3, height, width), dtype=torch.float32)
+    torch.onnx.export(
+        model, dummy, onnx_path,
+        input_names=['pixel_values'], output_names=['logits'],
+        dynamic_axes={'pixel_values': {0: 'batch'}, 'logits': {0: 'batch'}},
+        opset_version=opset, do_constant_folding=True,
+    )
+    print(f"Segmentation model exported to {onnx_path}")
+
+
+# export the keras classifier (tensorflow is only needed here, never by the onnx backend)
+def export_classifier(keras_path, onnx_path, opset=17):
+    import tensorflow as tf
+    import tf2onnx
+
+    class_model = load_class_model(keras_path)
+    width, height = DatasetConfig.IMAGE_SIZE
+    spec = (tf.TensorSpec((None, height, width, 3), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(class_model, input_signature=spec, opset=opset, output_path=onnx_path)
+    print(f"Classification model exported to {onnx_path}")
+
+
+# inputs for the parity check: real slices when a folder is given, random images otherwise
+def parity_inputs(images_dir=None, num_images=16):
+    width, height = DatasetConfig.IMAGE_SIZE
+    paths = sorted(glob.glob(os.path.join(images_dir, '*.png')))[:num_images] if images_dir else []
+    if paths:
+        images_clf, images_seg, _ = load_slices(paths, DatasetConfig.IMAGE_SIZE)
+    else:
+        rng = np.random.default_rng(42)
+        images_clf = images_seg = rng.integers(0, 256, (num_images, height, width, 3), dtype=np.uint8)
+    images_clf = normalize_classif_batch(images_clf, DatasetConfig.MEAN_CLF, DatasetConfig.STD_CLF)
+    images_norm = normalize_segmentation_batch(images_seg, DatasetConfig.MEAN, DatasetConfig.STD)
+    return images_clf, images_norm
+
+
+# compare eager pytorch / keras outputs with onnx runtime on the same inputs. the onnx classifier replaces the
+# keras one in the default serving path, so it is only accepted (in the report, with the digest of the file) when
+# no slice changes side of THR
+@torch.inference_mode()
+def check_parity(ckpt_path, keras_path, seg_onnx_path, class_onnx_path, images_dir=None, batch_size=8,
+                 report_path=ONNX_REPORT_PATH):
+    from onnx_backend import OnnxSegmenter, OnnxClassifier
+
+    images_clf, images_norm = parity_inputs(images_dir)
+    device = torch.device("cpu")
+    model, onnx_model = load_segmentation_model(ckpt_path, device), OnnxSegmenter(seg_onnx_path)
+    class_model, onnx_class_model = load_class_model(keras_path), OnnxClassifier(class_onnx_path)
+
+    max_logit_diff, label_agreement = 0.0, []
+    for start_idx in range(0, len(images_norm), batch_size):
+        batch = images_norm[start_idx:start_idx + batch_size]
+        logits, onnx_logits = model(batch), onnx_model(batch)
+        max_logit_diff = max(max_logit_diff, (logits - onnx_logits).abs().max().item())
+        label_agreement.append((logits.argmax(dim=1) == onnx_logits.argmax(dim=1)).float().mean().item())
+
+    scores = class_model.predict(images_clf, verbose=0).reshape(-1)
+    onnx_scores = onnx_class_model.predict(images_clf).reshape(-1)
+    decisions_agree = np.mean((scores > DatasetConfig.THR) == (onnx_scores > DatasetConfig.THR))
+    num_flipped = int(np.sum((scores > DatasetConfig.THR) != (onnx_scores > DatasetConfig.THR)))
+    accepted = num_flipped == 0
+
+    report = {
+        'num_slices': len(images_clf),
+        'inputs': 'slices' if images_dir else 'random images',
+        'thr': DatasetConfig.THR,
+        'max_score_diff': float(np.abs(scores - onnx_scores).max()),
+        'decision_agreement': float(decisions_agree),
+        'decisions_flipped': num_flipped,
+        'max_logit_diff': max_logit_diff,
+        'pixel_label_agreement': float(np.mean(label_agreement)),
+        'accepted': accepted,
+        'digests': {class_onnx_path: file_hash(class_onnx_path)},
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Segmentation: max |logit diff| = {max_logit_diff:.2e}, pixel label agreement = {np.mean(label_agreement):.4%}")
+    print(f"Classification: max |score diff| = {report['max_score_diff']:.2e}, "
+          f"THR decision agreement = {decisions_agree:.2%}")
+    if num_flipped:
+        print(f"{num_flipped} slice(s) change side of THR = {DatasetConfig.THR} with the onnx classifier.")
+    print(f"onnx classifier {'ACCEPTED' if accepted else 'REJECTED'}, report in {report_path}")
+    return max_logit_diff, float(np.mean(label_agreement)), float(decisions_agree)
+
+
+def main(ckpt, keras, seg_onnx, class_onnx, images_dir, skip_export):
+    if not skip_export:
+        export_segmentation(ckpt, seg_onnx)
+        export_classifier(keras, class_onnx)
+    check_parity(ckpt, keras, seg_onnx, class_onnx, images_dir)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    # Define input parameters
+    parser.add_argument("-ckpt", type=str, default=CKPT_PATH, help=f"Lightning checkpoint of the segmentation model (default '{CKPT_PATH}')")
+    parser.add_argument("-keras", type=str, default=CLASS_MODEL_PATH, help=f"Keras classification model (default '{CLASS_MODEL_PATH}')")
+    parser.add_argument("-seg_onnx", type=str, default=SEG_ONNX_PATH, help=f"Output path of the segmentation export (default '{SEG_ONNX_PATH}')")
+    parser.add_argument("-class_onnx", type=str, default=CLASS_ONNX_PATH, help=f"Output path of the classification export (default '{CLASS_ONNX_PATH}')")
+    parser.add_argument("-images_dir", type=str, default=None, help="Folder of slices used for the parity check (default: random images)")
+    parser.add_argument("-skip_export", action="store_true", help="Only run the parity check on existing exports")
+
+    args = parser.parse_args()
+    main(args.ckpt, args.keras, args.seg_onnx, args.class_onnx, args.images_dir, args.skip_export)
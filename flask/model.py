@@ -1,17 +1,25 @@
 import os
 import cv2
+import hashlib
+import threading
+import collections
+import json
+import time
 import numpy as np
 from dataclasses import dataclass
 
+# keep transformers from importing tensorflow: the serving path is pytorch (+ onnx runtime) only
+os.environ.setdefault("USE_TF", "0")
+
 import torch
 import torch.nn.functional as F
 import lightning.pytorch as pl
-from torchvision import transforms
 from transformers import SegformerForSemanticSegmentation
 
-from keras.models import load_model
-import albumentations as A
-from albumentations.pytorch import ToTensorV2
+from writer import FrameWriter
+from pipeline import run_pipeline
+from batcher import MicroBatcher
+from cache import CacheConfig, ResultCache, slice_key
 
 
 # class for dataset configuration
@@ -31,6 +39,18 @@ class DatasetConfig:
 class InferenceConfig:
     BATCH_SIZE:  int = 12 # can increase the batch size to find faster optimization 
     NUM_BATCHES: int = 2
+    PIPELINED: bool = True # overlap decoding and writing with the forward passes (see inference_pipelined)
+    READ_WORKERS: int = 2  # threads decoding batches ahead of the models
+    QUEUE_SIZE: int = 2    # batches allowed to wait between two pipeline stages
+    SHARED_BATCHING: bool = True # merge the slices of concurrent requests into shared forward passes
+    MAX_BATCH_SIZE: int = 32     # largest merged batch
+    MAX_WAIT: float = 0.005      # seconds a merged batch waits for more slices before it runs
+    CLF_BATCH_SIZE: int = 32     # slices decoded and classified together
+    SEG_BATCH_SIZE: int = 8      # classifier-positive slices segmented together
+    BACKEND: str = 'torch'       # 'torch' (eager pytorch segformer + onnx classifier, no tensorflow),
+                                 # 'keras' (eager pytorch segformer + the original keras classifier),
+                                 # 'onnx' (both models through onnx runtime)
+                                 # or 'int8' (quantized onnx, only used when quantize.py accepted it)
     
 # mapping of class ID to RGB value. (earthy pink tones now)
 id2color = {
@@ -40,6 +60,19 @@ id2color = {
     3: (100, 82, 183),  # large Bowel
 }
 
+# location of the trained models (downloaded into the static folder, see README)
+CKPT_PATH = 'static/checkpoint.ckpt'
+CLASS_MODEL_PATH = 'static/classification_model.keras'
+# onnx exports of both models (created with export_onnx.py)
+SEG_ONNX_PATH = 'static/segmentation.onnx'
+CLASS_ONNX_PATH = 'static/classification.onnx'
+# parity check of the onnx classifier against the keras one, which gates its use (created with export_onnx.py)
+ONNX_REPORT_PATH = 'static/onnx_parity_report.json'
+# int8 quantized exports and the accuracy report that gates their use (created with quantize.py)
+SEG_INT8_PATH = 'static/segmentation.int8.onnx'
+CLASS_INT8_PATH = 'static/classification.int8.onnx'
+QUANT_REPORT_PATH = 'static/quantization_report.json'
+
 # lightning module class for segmentation model
 class MedicalSegmentationModel(pl.LightningModule):
     def __init__(
@@ -62,158 +95,328 @@ class MedicalSegmentationModel(pl.LightningModule):
         # Loading model using the function defined above.
         self.model = get_model(model_name=self.hparams.model_name, num_classes=self.hparams.num_classes)
 
+    # raw SegFormer logits, at a quarter of the input resolution: segment_images() upsamples them once,
+    # straight to the size of each slice
     def forward(self, data):
         outputs = self.model(pixel_values=data, return_dict=True)
-        upsampled_logits = F.interpolate(outputs["logits"], size=data.shape[-2:], mode="bilinear", align_corners=False)
-        return upsampled_logits
+        return outputs["logits"]
     
 
-# converting numpy array to rgb values
-def num_to_rgb(num_arr, color_map=id2color):
-    single_layer = np.squeeze(num_arr)
-    output = np.zeros(num_arr.shape[:2] + (3,))
-
-    for k in color_map.keys():
-        output[single_layer == k] = color_map[k]
+# palette lookup table: class id -> uint8 RGB, indexed straight with the argmax labels
+PALETTE = np.array([id2color[k] for k in sorted(id2color)], dtype=np.uint8)
+# colors drawn on the overlay (segmentation map blended with beta = 0.99 over the zeroed-out CT pixels)
+OVERLAY_PALETTE = (PALETTE * 0.99).astype(np.uint8)
 
-    # return a floating point array in range [0.0, 1.0]
-    return np.float32(output) / 255.0
 
+# converting a batch of (N, H, W) label maps to (N, H, W, 3) uint8 rgb masks
+def labels_to_rgb(labels, palette=PALETTE):
+    return palette[labels]
 
-# Function to overlay a segmentation map on top of an RGB image.
-def image_overlay(image, segmented_image):
-    alpha = 1.0  # Transparency for the original image.
-    beta = 0.99  # Transparency for the segmentation map.
-    gamma = 0.0  # Scalar added to each sum.
 
-    # RBG to BGR for both, overlay transparent masks over CT scan, back to RGB
-    segmented_image = cv2.cvtColor(segmented_image, cv2.COLOR_RGB2BGR)
-    image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-    # Set to zero the segmented pixels in the images to ensure opacity after overlay
-    image = image * np.where(segmented_image == 0, 1, 0).astype(np.uint8)
-    # apply mask overlay
-    image = cv2.addWeighted(image, alpha, segmented_image, beta, gamma, image)
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+# overlay the segmentation maps on top of a batch of (N, H, W, 3) uint8 images:
+# segmented pixels take the (opaque) organ color, everything else keeps the CT pixel
+def overlay_batch(images, labels, palette=OVERLAY_PALETTE):
+    return np.where((labels > 0)[..., None], palette[labels], images)
 
-    return np.clip(image, 0.0, 1.0)
 
+# decode a slice once and derive everything both models need from that single buffer:
+# the linear-resized view for the classifier, the nearest-resized view for the segmentation model
+# (must be nearest, as the model was trained with this method) and the slice itself at its original size
+def load_slice(file_path, size):
+    image = cv2.cvtColor(cv2.imread(file_path, cv2.IMREAD_COLOR), cv2.COLOR_BGR2RGB)
+    image_clf = cv2.resize(image, size, interpolation=cv2.INTER_LINEAR)
+    image_seg = cv2.resize(image, size, interpolation=cv2.INTER_NEAREST)
+    return image_clf, image_seg, image
 
-# load and resize the image to the specified size.
-# The interpolation method used is nearest-neighbor for the segmentation model.
-def load_file_nearest(size, file_path, depth=0):
-    file = cv2.imread(file_path, depth)
-    if depth == cv2.IMREAD_COLOR:
-        file = file[:, :, ::-1]
-    return cv2.resize(file, (size), interpolation=cv2.INTER_NEAREST)
 
+# load a batch of slices, stacking the resized uint8 views as (N, H, W, 3) arrays
+# (the original slices are returned as a list, they don't all have to share one size)
+def load_slices(file_paths, size):
+    views_clf, views_seg, images = zip(*(load_slice(file_path, size) for file_path in file_paths))
+    return np.stack(views_clf), np.stack(views_seg), list(images)
 
-# load and resize the image to the specified size.
-# The interpolation method used is linear for the classification model.
-def load_file_linear(size, file_path, depth=0):
-    file = cv2.imread(file_path, depth)
-    if depth == cv2.IMREAD_COLOR:
-        file = file[:, :, ::-1]
-    return cv2.resize(file, (size), interpolation=cv2.INTER_LINEAR)
 
+# Classification: normalize a whole (N, H, W, 3) uint8 batch using the specified mean and standard deviation values
+def normalize_classif_batch(images, mean, std):
+    images = images.astype(np.float32)
+    images *= 1.0 / (255.0 * std)
+    images -= mean / std
+    return images
 
-# Classification: normalize image using the specified mean and standard deviation values
-def normalize_classif(image, mean, std):
-    image = image / 255.0
-    image = (image - mean) / std
-    return image
 
-
-# Segmentation: compose mean-std normalization and to-tensor pipeline
-def setup_transforms(mean, std):
-    transforms = []
-    transforms.extend([
-        A.Normalize(mean=mean, std=std, always_apply=True),
-        ToTensorV2(always_apply=True),  # (H, W, C) --> (C, H, W)
-    ])
-    return A.Compose(transforms)
+# Segmentation: mean-std normalization of a whole (N, H, W, 3) uint8 batch (same maths as A.Normalize),
+# returned as a (N, C, H, W) float tensor
+def normalize_segmentation_batch(images, mean, std):
+    mean = np.asarray(mean, dtype=np.float32) * 255.0
+    std = np.asarray(std, dtype=np.float32) * 255.0
+    images = images.astype(np.float32)
+    images -= mean
+    images /= std
+    return torch.from_numpy(images.transpose(0, 3, 1, 2).copy())
 
 
+# one batch of slices on its way through the models
+@dataclass
+class SliceBatch:
+    paths: list
+    images_org: list               # (H, W, 3) uint8 slices at their original size
+    images_clf: np.ndarray         # (N, H, W, 3) float32, normalized for the classifier
+    images_norm: torch.Tensor      # (N, 3, H, W) float32, normalized for the segmentation model
+    orig_sizes: list               # original (H, W) of every slice
+    scores: np.ndarray = None      # classifier outputs
+    true_idxs: np.ndarray = None   # slices the classifier sent to segmentation
+    labels: list = None            # (H, W) uint8 predicted class ids, at the original size of each slice
+    pending: int = 0               # positive slices still waiting for segmentation
+    keys: list = None              # result cache keys of the slices
+    cached: dict = None            # index -> (score, labels) of the slices found in the cache
+
+
+# stage 1: decode and normalize a batch of slices, and look them up in the result cache
+def prepare_batch(paths, img_size, cache=None, model_version=''):
+    images_clf, images_seg, images_org = load_slices(paths, img_size)
+    images_clf = normalize_classif_batch(images_clf, DatasetConfig.MEAN_CLF, DatasetConfig.STD_CLF)
+    images_norm = normalize_segmentation_batch(images_seg, DatasetConfig.MEAN, DatasetConfig.STD)
+    orig_sizes = [image.shape[:2] for image in images_org]
+    batch = SliceBatch(list(paths), images_org, images_clf, images_norm, orig_sizes, cached={})
+    if cache is not None:
+        batch.keys = [slice_key(path, model_version) for path in paths]
+        found = cache.get_many(batch.keys)
+        batch.cached = {idx: found[key] for idx, key in enumerate(batch.keys) if key in found}
+    return batch
+
+
+# classifier scores for a stack of normalized images
+def classify_images(class_model, images_clf):
+    return class_model.predict(images_clf, verbose=0).reshape(-1)
+
+
+# predicted class ids, as (N, H, W) uint8 label maps at the input size, for a stack of normalized images.
+# with `sizes`, the logits are upsampled to the (H, W) of every slice before the argmax, and a list of
+# label maps at the original resolution is returned (one interpolation per distinct size, so usually one).
+# the model returns the logits at its own output resolution, so each slice is only interpolated once.
 @torch.inference_mode()
-def inference(model, class_model, image_paths, img_size, batch_size=24, device="cpu"):
-    # retrieve number of images, computer number of batches
-    num_images = len(image_paths)
-    num_batches = (num_images + batch_size - 1) // batch_size
-    
-    # Define mean and std
-    mean_seg = DatasetConfig.MEAN
-    std_seg = DatasetConfig.STD
-    mean_clf = DatasetConfig.MEAN_CLF
-    std_clf = DatasetConfig.STD_CLF
-    
-    # Create a composition of preprocessing transformations for the segmentation model
-    transforms  = setup_transforms(mean=mean_seg, std=std_seg)
-    
+def segment_images(model, images_norm, device, sizes=None):
+    predictions = model(images_norm.to(device))
+    if sizes is None:
+        upsampled = F.interpolate(predictions, size=images_norm.shape[-2:], mode="bilinear", align_corners=False)
+        return upsampled.argmax(dim=1).to(torch.uint8).cpu().numpy()
+    labels = [None] * len(sizes)
+    for size in set(map(tuple, sizes)):
+        idxs = [idx for idx, other in enumerate(sizes) if tuple(other) == size]
+        upsampled = F.interpolate(predictions[idxs], size=size, mode="bilinear", align_corners=False)
+        for idx, label in zip(idxs, upsampled.argmax(dim=1).to(torch.uint8).cpu().numpy()):
+            labels[idx] = label
+    return labels
+
+
+# stage 2: classification predictions, deciding which slices contain organs at all.
+# cached slices keep their stored score and never reach the models.
+def classify_batch(classify_fn, batch):
+    cached = batch.cached or {}
+    y_pred_clf = np.zeros(len(batch.images_clf), dtype=np.float32)
+    uncached = np.array([idx for idx in range(len(y_pred_clf)) if idx not in cached], dtype=int)
+    if len(uncached) > 0:
+        y_pred_clf[uncached] = classify_fn(batch.images_clf[uncached])
+    for idx, (score, _) in cached.items():
+        y_pred_clf[idx] = score
+    batch.scores = y_pred_clf
+    clf_labels = np.zeros(len(y_pred_clf), dtype=bool)
+    clf_labels[uncached] = y_pred_clf[uncached] > DatasetConfig.THR
+    batch.true_idxs = np.where(clf_labels == True)[0]
+    return batch
+
+
+# classifier batch size before CLF_BATCH_SIZE, with one segmentation pass per batch: the baseline of the report
+BASELINE_BATCH_SIZE = 10
+
+
+# stage 3: segmentation cascade. negatives get an empty mask without touching the model, while the
+# positives of consecutive batches are gathered and segmented in full batches of `seg_batch_size`
+# (instead of one forward pass per classifier batch, often on only 1-3 slices). a batch is passed on
+# once all of its positives are segmented; feed() and flush() return the batches that became ready.
+# with the shared segmentation `service`, report() counts the forward passes it ran instead of the calls.
+class SegmentationRepacker:
+    def __init__(self, segment_fn, seg_batch_size=InferenceConfig.SEG_BATCH_SIZE, service=None,
+                 baseline_batch_size=BASELINE_BATCH_SIZE):
+        self.segment_fn = segment_fn
+        self.seg_batch_size = seg_batch_size
+        self.service = service
+        self.baseline_batch_size = baseline_batch_size
+        self._service_batches = service.num_batches if service is not None else 0
+        self._waiting = collections.deque()  # batches in input order, waiting for their positives
+        self._positives = []                 # (batch, index) of positives not segmented yet
+        self.num_slices = 0
+        self.num_cached = 0
+        self.num_positives = 0
+        self.forward_calls = 0
+        self._baseline_batches = set()       # the classifier batches of the baseline holding positives
+
+    def feed(self, batch):
+        num_images = len(batch.paths)
+        batch.labels = [np.zeros(size, dtype=np.uint8) for size in batch.orig_sizes]
+        for idx, (_, labels) in (batch.cached or {}).items():
+            batch.labels[idx] = labels
+        batch.pending = len(batch.true_idxs)
+        self._waiting.append(batch)
+        self._positives.extend((batch, idx) for idx in batch.true_idxs)
+
+        self._baseline_batches.update((self.num_slices + idx) // self.baseline_batch_size for idx in batch.true_idxs)
+        self.num_slices += num_images
+        self.num_cached += len(batch.cached or {})
+        self.num_positives += len(batch.true_idxs)
+
+        while len(self._positives) >= self.seg_batch_size:
+            self._segment(self._positives[:self.seg_batch_size])
+            del self._positives[:self.seg_batch_size]
+        return self._ready()
+
+    # segment what is left (one last, partial batch) and release every batch
+    def flush(self):
+        if self._positives:
+            self._segment(self._positives)
+            self._positives = []
+        return self._ready()
+
+    def _segment(self, refs):
+        labels = self.segment_fn(torch.stack([batch.images_norm[idx] for batch, idx in refs]),
+                                 [batch.orig_sizes[idx] for batch, idx in refs])
+        self.forward_calls += 1
+        for (batch, idx), label in zip(refs, labels):
+            batch.labels[idx] = label
+            batch.pending -= 1
+
+    def _ready(self):
+        ready = []
+        while self._waiting and self._waiting[0].pending == 0:
+            ready.append(self._waiting.popleft())
+        return ready
+
+    # what one forward pass per classifier batch of the baseline size would have cost
+    @property
+    def per_batch_calls(self):
+        return len(self._baseline_batches)
+
+    # forward passes actually run: the calls, or the batches the shared service ran meanwhile (which may hold
+    # the slices of concurrent requests too)
+    @property
+    def forward_passes(self):
+        if self.service is None:
+            return self.forward_calls
+        return self.service.num_batches - self._service_batches
+
+    def report(self):
+        passes = self.forward_passes
+        saved = self.per_batch_calls - passes
+        shared = " of the shared service" if self.service is not None else ""
+        print(f"Segmented {self.num_positives}/{self.num_slices} slices in {self.forward_calls} batches of up to "
+              f"{self.seg_batch_size}, {passes} forward passes{shared} ({saved} saved vs. one pass per classifier "
+              f"batch of {self.baseline_batch_size}).")
+        if self.num_cached:
+            print(f"{self.num_cached}/{self.num_slices} slices served from the result cache.")
+
+
+# stage 4: color the masks, build the overlays on the original slices and hand them to the writer
+# (new results are added to the cache on the way), and put the label maps in the study's LabelVolume.
+# returns the overlay path of every slice.
+def save_batch(batch, writer, labels, cache=None):
+    if cache is not None and batch.keys:
+        cache.put_many((batch.keys[idx], batch.scores[idx], batch.labels[idx])
+                       for idx in range(len(batch.paths)) if idx not in batch.cached)
+
     # list to collect overlaid paths
     overlay_paths = []
+    for i, image_path in enumerate(batch.paths):
+        # Get the filename from the original image path
+        save_path = 'static/uploads/overlaid'
+        mask_save_path = 'static/uploads/masks'  # New path for saving masks
+        filename = os.path.splitext(os.path.basename(image_path))[0]
+
+        # Hand the overlaid image (and the mask image, if asked for) to the writer
+        overlay = overlay_batch(batch.images_org[i], batch.labels[i])
+        overlay_filename = writer.submit_overlay(os.path.join(save_path, f"{filename}_overlaid"), overlay)
+        if writer.config.WRITE_MASKS:
+            writer.submit_mask(os.path.join(mask_save_path, f"{filename}_mask"), labels_to_rgb(batch.labels[i]))
+
+        overlay_paths.append(overlay_filename)
+    labels.put(batch.paths, batch.labels)
+    return overlay_paths
+
+
+# the (slices, H, W) uint8 label volume of a study, filled as the batches are saved, with the slices ordered by
+# file name like the masks the 3D rendering used to read back from disk. the volume is created by
+# `allocate(shape)` once the first label map gives the slice size: a zeroed array by default, or e.g. the
+# scratch file of threed.new_label_volume, so the labels are never held in a list or stacked in RAM.
+class LabelVolume:
+    def __init__(self, image_paths, allocate=None):
+        order = sorted(range(len(image_paths)), key=lambda idx: os.path.basename(image_paths[idx]))
+        self.slots = {image_paths[idx]: slot for slot, idx in enumerate(order)}
+        self.num_slices = len(image_paths)
+        self.allocate = allocate or (lambda shape: np.zeros(shape, dtype=np.uint8))
+        self.volume = None if self.num_slices else np.zeros((0, 0, 0), dtype=np.uint8)
+
+    def put(self, paths, labels):
+        for path, label in zip(paths, labels):
+            if self.volume is None:
+                self.volume = self.allocate((self.num_slices,) + label.shape)
+            self.volume[self.slots[path]] = label
+
+
+# split the list of image paths into batches
+def batch_paths(image_paths, batch_size):
+    return [image_paths[start_idx:start_idx + batch_size] for start_idx in range(0, len(image_paths), batch_size)]
+
+
+def inference(model, class_model, image_paths, img_size, batch_size=24, device="cpu", writer_config=None, shared=False,
+              backend=InferenceConfig.BACKEND, seg_batch_size=InferenceConfig.SEG_BATCH_SIZE, cache=None, model_version='',
+              allocate=None):
+    classify_fn, segment_fn = forward_fns(model, class_model, device, shared, backend)
+    repacker = SegmentationRepacker(segment_fn, seg_batch_size, services[backend][1] if shared else None)
+    # list to collect the overlaid paths, and the label volume the label maps go into
+    overlay_paths = []
+    labels = LabelVolume(image_paths, allocate)
+    # background writer, so png encoding and disk i/o overlap with the next batch
+    writer = FrameWriter(writer_config)
 
     # iterate over each batch 
-    for batch_idx in range(num_batches):
-        # capturing starting and ending index for each batch
-        start_idx = batch_idx * batch_size
-        end_idx = min((batch_idx + 1) * batch_size, num_images)
-        batch_diff = end_idx - start_idx + 1
-        # initiating lists for collecting batches of images
-        batch_images_org = []         
-        batch_images_clf = []
-        batch_images_norm = []
-
-        # iterate over each image in batch
-        for idx in range(start_idx, end_idx):
-            
-            # Load and preprocess image for classification
-            image_clf = load_file_linear(DatasetConfig.IMAGE_SIZE, image_paths[idx], depth=cv2.IMREAD_COLOR)
-            image_clf = normalize_classif(image_clf, mean_clf, std_clf)
-            
-            # Load and preprocess image file for segmentation
-            image_org = load_file_nearest(DatasetConfig.IMAGE_SIZE, image_paths[idx], depth=cv2.IMREAD_COLOR)
-            # image_norm = transforms.ToTensor()(image_org) #-- that is from older version
-            image_norm = transforms(image=image_org)["image"]
-        
-            # batch_image_org.append(image_org)
-            batch_images_org.append(image_org)            
-            batch_images_clf.append(image_clf)
-            batch_images_norm.append(image_norm)
-        
-        # Classification predictions
-        batch_images_clf = np.stack(batch_images_clf)
-        y_pred_clf = class_model.predict(batch_images_clf, verbose=0).reshape(-1)
-        clf_labels = y_pred_clf > DatasetConfig.THR
-        true_idxs = np.where(clf_labels == True)[0]
-        
-        # Segmentation predictions
-        batch_images_norm = torch.stack(batch_images_norm).to(device)
-        mask_dim = (batch_diff, DatasetConfig.IMAGE_SIZE[0], DatasetConfig.IMAGE_SIZE[1])
-        pred_all = torch.Tensor(np.zeros(mask_dim)).long()
-        if len(true_idxs) > 0:
-            predictions = model(batch_images_norm[true_idxs])
-            pred_all[true_idxs] = torch.from_numpy(predictions.argmax(dim=1).cpu().numpy())
-        
-        # Apply overlay to each batch image
-        for i in range(len(batch_images_org)):
-            batch_img_np = np.float32(batch_images_org[i]) / 255.0
-            pred_mask_rgb = num_to_rgb(pred_all[i], color_map=id2color)
-            overlay_img = image_overlay(batch_img_np, pred_mask_rgb)
-            
-            # Get the filename from the original image path
-            save_path = 'static/uploads/overlaid'
-            mask_save_path = 'static/uploads/masks'  # New path for saving masks
-            filename = os.path.splitext(os.path.basename(image_paths[start_idx + i]))[0]
-            overlay_filename = os.path.join(save_path, f"{filename}_overlaid.png")
-            mask_filename = os.path.join(mask_save_path, f"{filename}_mask.png")  # Mask filename
-            
-            # Save the overlaid image
-            cv2.imwrite(overlay_filename, (overlay_img * 255).astype(np.uint8), [cv2.IMWRITE_PNG_COMPRESSION, 9])
-            # Save the mask image
-            cv2.imwrite(mask_filename, (pred_mask_rgb * 255).astype(np.uint8), [cv2.IMWRITE_PNG_COMPRESSION, 9])
-            
-            overlay_paths.append(overlay_filename)
-            
-    return overlay_paths
+    for paths in batch_paths(image_paths, batch_size):
+        batch = classify_batch(classify_fn, prepare_batch(paths, img_size, cache, model_version))
+        for ready in repacker.feed(batch):
+            overlay_paths.extend(save_batch(ready, writer, labels, cache))
+    for ready in repacker.flush():
+        overlay_paths.extend(save_batch(ready, writer, labels, cache))
+    repacker.report()
+
+    # every file must be on disk before the pages read them
+    writer.flush()
+    return overlay_paths, labels.volume
+
+
+# same stages and same result as inference(), but streamed: a pool of reader threads decodes the next
+# batches while the classifier and segmentation model run, and the writer stage saves the previous one.
+# the stages are connected by bounded queues, so memory stays flat whatever the length of the study.
+def inference_pipelined(model, class_model, image_paths, img_size, batch_size=24, device="cpu", writer_config=None, shared=False,
+                        backend=InferenceConfig.BACKEND, seg_batch_size=InferenceConfig.SEG_BATCH_SIZE,
+                        read_workers=InferenceConfig.READ_WORKERS, queue_size=InferenceConfig.QUEUE_SIZE,
+                        cache=None, model_version='', allocate=None):
+    classify_fn, segment_fn = forward_fns(model, class_model, device, shared, backend)
+    repacker = SegmentationRepacker(segment_fn, seg_batch_size, services[backend][1] if shared else None)
+    overlay_paths = []
+    labels = LabelVolume(image_paths, allocate)
+    writer = FrameWriter(writer_config)
+
+    stages = [
+        lambda batch: classify_batch(classify_fn, batch),
+        repacker,
+        lambda batch: save_batch(batch, writer, labels, cache),
+    ]
+    for saved in run_pipeline(batch_paths(image_paths, batch_size),
+                              lambda paths: prepare_batch(paths, img_size, cache, model_version),
+                              stages, read_workers=read_workers, queue_size=queue_size):
+        overlay_paths.extend(saved)
+    repacker.report()
+
+    writer.flush()
+    return overlay_paths, labels.volume
 
 
 # retrieving segmentation model
@@ -229,27 +432,292 @@ def get_model(*, model_name, num_classes):
 # retrieving classification model
 def get_class_model(class_model_loc, class_model):
     # classification model instantiation
+    # keras (and so tensorflow) is only imported when the keras classifier is actually used
+    from keras.models import load_model
     class_model_path = os.path.join(class_model_loc, class_model)
     class_model = load_model(class_model_path)
     return class_model
     
     
-# loading checkpoint and model 
-def predict(image_paths):
-    
-    CKPT_PATH = 'static/checkpoint.ckpt'
-    model = MedicalSegmentationModel.load_from_checkpoint(CKPT_PATH)
-            
-    DEVICE = torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
-    model.to(DEVICE)
+# pick the gpu when there is one
+def get_device():
+    return torch.device("cuda:0") if torch.cuda.is_available() else torch.device("cpu")
+
+
+# cheap fingerprint of a model file (mtime + size), used to notice a replaced checkpoint
+def file_stat(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+# content hash of a model file, used to confirm a checkpoint really changed before reloading it
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# loading the segmentation checkpoint onto the device in eval mode
+def load_segmentation_model(ckpt_path, device):
+    model = MedicalSegmentationModel.load_from_checkpoint(ckpt_path, map_location=device)
+    model.to(device)
     model.eval()
-    
-    # predictions classification
-    class_model = 'classification_model.keras'
-    class_model_loc = 'static/'
-    class_model = get_class_model(class_model_loc, class_model)
+    return model
 
-    predictions = inference(model, class_model, image_paths, img_size=DatasetConfig.IMAGE_SIZE, batch_size=10, device=DEVICE)
-    
-    return predictions
 
+# run a dummy batch through the segmentation model so the first real request doesn't pay for lazy init
+@torch.inference_mode()
+def warm_up_segmentation_model(model, device):
+    dummy = torch.zeros((1, 3, DatasetConfig.IMAGE_SIZE[1], DatasetConfig.IMAGE_SIZE[0]), device=device)
+    model(dummy)
+
+
+# loading the keras classifier (the device is handled by tensorflow itself)
+def load_class_model(class_model_path, device=None):
+    return get_class_model(*os.path.split(class_model_path))
+
+
+# same for the classifier (builds the keras predict function once)
+def warm_up_class_model(class_model, device=None):
+    dummy = np.zeros((1, DatasetConfig.IMAGE_SIZE[1], DatasetConfig.IMAGE_SIZE[0], 3), dtype=np.float32)
+    class_model.predict(dummy, verbose=0)
+
+
+# loading the onnx exports; onnx runtime is only imported when that backend is used
+def load_onnx_segmentation_model(onnx_path, device=None):
+    from onnx_backend import OnnxSegmenter
+    return OnnxSegmenter(onnx_path)
+
+
+def load_onnx_class_model(onnx_path, device=None):
+    from onnx_backend import OnnxClassifier
+    return OnnxClassifier(onnx_path)
+
+
+# a loaded model together with the fingerprint of the file it came from
+@dataclass
+class ModelHandle:
+    model: object
+    stat: tuple
+    digest: str
+    version: int
+
+
+# process-wide registry: every model is loaded (and warmed up) once per worker and handed out ready to use.
+# the files are re-checked at most every `check_interval` seconds; when the mtime/size changes and the
+# content hash differs, the model is reloaded and swapped in without a restart.
+class ModelRegistry:
+    def __init__(self, check_interval=5.0):
+        self.check_interval = check_interval
+        self.device = get_device()
+        self._lock = threading.Lock()
+        self._specs = {}
+        self._handles = {}
+        self._last_check = {}
+
+    # declare a model: where it lives, how to load it and how to warm it up
+    def register(self, name, path, loader, warm_up=None):
+        with self._lock:
+            self._specs[name] = (path, loader, warm_up)
+            self._handles.pop(name, None)
+
+    # load (or reload) one model from disk, warm it up and publish the new handle
+    def _load(self, name, stat, digest):
+        path, loader, warm_up = self._specs[name]
+        model = loader(path, self.device)
+        if warm_up is not None:
+            warm_up(model, self.device)
+        previous = self._handles.get(name)
+        version = previous.version + 1 if previous else 1
+        self._handles[name] = ModelHandle(model, stat, digest, version)
+        if previous:
+            print(f"Reloaded {name} model from {path} (version {version}).")
+        return self._handles[name]
+
+    # return the ready handle for a model, hot-swapping it if the file on disk changed. while the file can't
+    # be read (e.g. being replaced), the loaded model stays in use and the next check tries again.
+    def get_handle(self, name):
+        with self._lock:
+            path = self._specs[name][0]
+            handle = self._handles.get(name)
+            now = time.monotonic()
+            if handle is not None and now - self._last_check.get(name, 0.0) < self.check_interval:
+                return handle
+            self._last_check[name] = now
+            try:
+                stat = file_stat(path)
+                if handle is not None and handle.stat == stat:
+                    return handle
+                digest = file_hash(path)
+            except OSError as e:
+                if handle is None:
+                    raise
+                print(f"Could not check {path} ({e}), keeping {name} model version {handle.version}.")
+                return handle
+            if handle is not None and handle.digest == digest:
+                # touched but not changed: just remember the new stat
+                handle.stat = stat
+                return handle
+            return self._load(name, stat, digest)
+
+    def get(self, name):
+        return self.get_handle(name).model
+
+    # version string of the given (default: every registered) models, changes whenever one is swapped
+    def version(self, names=None):
+        return "-".join(f"{name}:{self.get_handle(name).digest[:12]}" for name in sorted(names or self._specs))
+
+    # load and warm the given (default: every) registered models up front (called once when the app starts)
+    def warm_up(self, names=None):
+        for name in names or list(self._specs):
+            path = self._specs[name][0]
+            if not os.path.exists(path):
+                print(f"Model file {path} not found, {name} model will be loaded on first use.")
+                continue
+            self.get_handle(name)
+
+
+# one registry per worker process
+registry = ModelRegistry()
+registry.register('segmentation', CKPT_PATH, load_segmentation_model, warm_up_segmentation_model)
+registry.register('classification', CLASS_MODEL_PATH, load_class_model, warm_up_class_model)
+registry.register('segmentation-onnx', SEG_ONNX_PATH, load_onnx_segmentation_model, warm_up_segmentation_model)
+registry.register('classification-onnx', CLASS_ONNX_PATH, load_onnx_class_model, warm_up_class_model)
+registry.register('segmentation-int8', SEG_INT8_PATH, load_onnx_segmentation_model, warm_up_segmentation_model)
+registry.register('classification-int8', CLASS_INT8_PATH, load_onnx_class_model, warm_up_class_model)
+
+# registry names of the (segmentation, classification) models of each backend
+BACKEND_MODELS = {
+    'torch': ('segmentation', 'classification-onnx'),
+    'keras': ('segmentation', 'classification'),
+    'onnx': ('segmentation-onnx', 'classification-onnx'),
+    'int8': ('segmentation-int8', 'classification-int8'),
+}
+
+
+# whether a report accepted the exact model files on disk (it holds their digests). `checks` keeps the answer
+# for the current files: the report is only re-read and the models re-hashed when one of the files changed
+def report_accepts(report_path, model_paths, checks):
+    paths = (report_path,) + tuple(model_paths)
+    if not all(os.path.exists(path) for path in paths):
+        return False
+    stats = tuple(file_stat(path) for path in paths)
+    if stats not in checks:
+        try:
+            with open(report_path) as f:
+                report = json.load(f)
+        except ValueError:
+            report = {}
+        digests = report.get('digests', {})
+        checks.clear()
+        checks[stats] = bool(report.get('accepted')) and all(
+            digests.get(path) == file_hash(path) for path in model_paths)
+    return checks[stats]
+
+
+# the quantized models are only used when quantize.py measured their accuracy loss within the budget
+# (for the exact files on disk); otherwise fall back to the fp32 onnx models
+def quantized_models_accepted():
+    return report_accepts(QUANT_REPORT_PATH, (SEG_INT8_PATH, CLASS_INT8_PATH), _quant_checks)
+
+
+# the onnx classifier only replaces the keras one when export_onnx.py found every THR decision unchanged
+# (for the exact file on disk)
+def onnx_classifier_accepted():
+    return report_accepts(ONNX_REPORT_PATH, (CLASS_ONNX_PATH,), _parity_checks)
+
+
+_quant_checks = {}
+_parity_checks = {}
+
+
+def resolve_backend(backend):
+    if backend == 'int8' and not quantized_models_accepted():
+        print(f"Quantized models not accepted by {QUANT_REPORT_PATH}, using the fp32 onnx backend.")
+        backend = 'onnx'
+    # without an onnx export of the classifier that passed the parity check (export_onnx.py), tensorflow is
+    # still needed
+    if backend == 'torch' and not onnx_classifier_accepted():
+        print(f"{CLASS_ONNX_PATH} not accepted by {ONNX_REPORT_PATH}, running the classifier through keras.")
+        backend = 'keras'
+    return backend
+
+
+# shared services of a backend: its classifier and segmentation model (from the registry) serve every
+# request, with the slices (or positives) of concurrent requests merged into dynamically sized batches
+def make_services(backend):
+    seg_name, clf_name = BACKEND_MODELS[backend]
+    classification_service = MicroBatcher(
+        lambda items: classify_images(registry.get(clf_name), np.stack(items)),
+        max_batch_size=InferenceConfig.MAX_BATCH_SIZE, max_wait=InferenceConfig.MAX_WAIT, name=f'{clf_name}-service')
+    segmentation_service = MicroBatcher(
+        lambda items: segment_images(registry.get(seg_name), torch.stack([image for image, _ in items]), registry.device,
+                                     [size for _, size in items]),
+        max_batch_size=InferenceConfig.MAX_BATCH_SIZE, max_wait=InferenceConfig.MAX_WAIT, name=f'{seg_name}-service')
+    return classification_service, segmentation_service
+
+
+# one pair of services per backend and per worker (their threads only start on first use)
+services = {backend: make_services(backend) for backend in BACKEND_MODELS}
+
+
+# forward function going through a shared service: submit every image (with its original size, for
+# the segmentation service), wait for the routed results
+def shared_forward(service):
+    def forward(images, sizes=None):
+        futures = service.submit_many(list(images) if sizes is None else list(zip(images, sizes)))
+        return [future.result() for future in futures]
+    return forward
+
+
+# the classify / segment functions used by the stages, either calling the given models directly
+# or going through the shared services of the backend
+def forward_fns(model, class_model, device, shared=False, backend=InferenceConfig.BACKEND):
+    if shared:
+        classification_service, segmentation_service = services[backend]
+        return shared_forward(classification_service), shared_forward(segmentation_service)
+    return ((lambda images: classify_images(class_model, images)),
+            (lambda images, sizes: segment_images(model, images, device, sizes)))
+
+
+# format of the cached results, to bump whenever their shape or meaning changes
+# (2: label maps at the original slice size)
+RESULT_FORMAT = 2
+
+# the result cache is opened on first use, once per worker
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+
+def get_result_cache():
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache(CacheConfig.PATH, CacheConfig.MAX_BYTES)
+        return _result_cache
+
+
+# predicting with the models held by the registry, on the selected backend ('torch', 'keras', 'onnx' or 'int8').
+# returns the overlay paths and the (slices, H, W) uint8 label volume of the study, for the 3D rendering,
+# created with `allocate(shape)` (see LabelVolume)
+def predict(image_paths, pipelined=InferenceConfig.PIPELINED, shared=InferenceConfig.SHARED_BATCHING,
+            backend=InferenceConfig.BACKEND, allocate=None):
+    backend = resolve_backend(backend)
+    model = class_model = None
+    if not shared:
+        seg_name, clf_name = BACKEND_MODELS[backend]
+        model = registry.get(seg_name)
+        class_model = registry.get(clf_name)
+
+    # results of already seen slices come from the cache, as long as models and settings are unchanged
+    cache = get_result_cache() if CacheConfig.ENABLED else None
+    model_version = f"{registry.version(BACKEND_MODELS[backend])}|{DatasetConfig.IMAGE_SIZE}|{DatasetConfig.THR}|{RESULT_FORMAT}"
+
+    run = inference_pipelined if pipelined else inference
+    predictions, label_volume = run(model, class_model, image_paths, img_size=DatasetConfig.IMAGE_SIZE,
+                                    batch_size=InferenceConfig.CLF_BATCH_SIZE, device=registry.device, shared=shared,
+                                    backend=backend, cache=cache, model_version=model_version, allocate=allocate)
+    
+    return predictions, label_volume
@@ -0,0 +1,50 @@
+import os
+import numpy as np
+import torch
+import onnxruntime as ort
+from dataclasses import dataclass
+
+
+# class for onnx runtime configuration
+@dataclass
+class OnnxConfig:
+    INTRA_OP_THREADS: int = os.cpu_count() or 1 # threads used inside one operator (the big matmuls/convs)
+    INTER_OP_THREADS: int = 1                   # operators run in parallel (only useful in parallel execution mode)
+    PARALLEL_EXECUTION: bool = False            # the graphs are mostly sequential, so default to sequential mode
+
+
+# create an inference session with tuned threading and every graph optimization enabled
+def make_session(onnx_path, config=None):
+    config = config or OnnxConfig()
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = config.INTRA_OP_THREADS
+    options.inter_op_num_threads = config.INTER_OP_THREADS
+    options.execution_mode = ort.ExecutionMode.ORT_PARALLEL if config.PARALLEL_EXECUTION else ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    providers = [provider for provider in ('CUDAExecutionProvider', 'CPUExecutionProvider')
+                 if provider in ort.get_available_providers()]
+    return ort.InferenceSession(onnx_path, sess_options=options, providers=providers)
+
+
+# segmentation model running through onnx runtime. called like MedicalSegmentationModel:
+# (N, 3, H, W) float tensor in, (N, NUM_CLASSES, H/4, W/4) SegFormer logits tensor out
+class OnnxSegmenter:
+    def __init__(self, onnx_path, config=None):
+        self.session = make_session(onnx_path, config)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, images):
+        images = images.detach().cpu().numpy().astype(np.float32, copy=False)
+        logits = self.session.run(None, {self.input_name: images})[0]
+        return torch.from_numpy(logits)
+
+
+# slice classifier running through onnx runtime, with the same predict() call as the keras model
+class OnnxClassifier:
+    def __init__(self, onnx_path, config=None):
+        self.session = make_session(onnx_path, config)
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, images, verbose=0):
+        images = np.asarray(images, dtype=np.float32)
+        return self.session.run(None, {self.input_name: images})[0]
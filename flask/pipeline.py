@@ -0,0 +1,101 @@
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+# end-of-stream marker passed down the queues
+_DONE = object()
+
+
+# an exception raised inside a stage, carried downstream to the consumer
+class _Failure:
+    def __init__(self, exc):
+        self.exc = exc
+
+
+# put that gives up when the pipeline is being torn down (so no thread stays blocked on a full queue)
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+# source thread: submit every item to the reader pool, keeping at most `queue_size` pending futures
+# (order is preserved because the futures are queued in submission order)
+def _feed(items, fn, pool, out_q, stop):
+    try:
+        for item in items:
+            if not _put(out_q, pool.submit(fn, item), stop):
+                return
+    except Exception as exc:
+        _put(out_q, _Failure(exc), stop)
+        return
+    _put(out_q, _DONE, stop)
+
+
+# stage thread: apply `fn` to every item coming in and pass the result on.
+# a stage can also be an object with feed(item) and flush() methods returning lists of items; it may then
+# emit any number of items per input (e.g. to repack batches), and flush() is called at the end of the stream.
+def _stage(fn, in_q, out_q, stop):
+    while True:
+        item = in_q.get()
+        if stop.is_set():
+            return
+        if isinstance(item, _Failure):
+            _put(out_q, item, stop)
+            return
+        try:
+            if item is _DONE:
+                results = fn.flush() if hasattr(fn, 'feed') else []
+            else:
+                if isinstance(item, Future):
+                    item = item.result()
+                results = fn.feed(item) if hasattr(fn, 'feed') else [fn(item)]
+        except Exception as exc:
+            _put(out_q, _Failure(exc), stop)
+            return
+        for result in results:
+            if not _put(out_q, result, stop):
+                return
+        if item is _DONE:
+            _put(out_q, _DONE, stop)
+            return
+
+
+# streaming pipeline: `read_fn` runs on a pool of `read_workers` threads, then every function of
+# `stages` runs in its own thread, all connected by queues of `queue_size` items. results of the last
+# stage are yielded in input order; at most ~queue_size items wait between two stages, so memory stays
+# bounded however many items come in. the first exception raised by any stage is re-raised here.
+def run_pipeline(items, read_fn, stages, read_workers=2, queue_size=2):
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=queue_size) for _ in range(len(stages) + 1)]
+    pool = ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix='pipeline-read')
+    threads = [threading.Thread(target=_feed, args=(items, read_fn, pool, queues[0], stop), daemon=True)]
+    for idx, fn in enumerate(stages):
+        threads.append(threading.Thread(target=_stage, args=(fn, queues[idx], queues[idx + 1], stop), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = queues[-1].get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.exc
+            if isinstance(item, Future):
+                item = item.result()
+            yield item
+    finally:
+        stop.set()
+        # unblock stages still waiting on their input queue
+        for q in queues:
+            try:
+                q.put_nowait(_DONE)
+            except queue.Full:
+                pass
+        pool.shutdown(wait=False, cancel_futures=True)
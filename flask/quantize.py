@@ -0,0 +1,188 @@
+# INT8 quantization of the onnx exports (see export_onnx.py), calibrated on slices produced by
+# notebooks/prepare_data_model_evaluation.py, with a report of the latency speedup and the per-organ
+# Dice delta against the fp32 models. The int8 backend of predict() is only enabled when every Dice
+# delta is within the budget.
+# Run from the flask folder: python quantize.py -images_dir output/test/images -masks_dir output/test/masks
+import os
+import glob
+import json
+import time
+import numpy as np
+import cv2
+from dataclasses import dataclass
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quantize_static)
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from model import (DatasetConfig, SEG_ONNX_PATH, CLASS_ONNX_PATH, SEG_INT8_PATH, CLASS_INT8_PATH, QUANT_REPORT_PATH,
+                   load_slices, normalize_classif_batch, normalize_segmentation_batch, classify_images,
+                   segment_images, file_hash)
+from onnx_backend import OnnxSegmenter, OnnxClassifier, make_session
+
+
+# class for quantization configuration
+@dataclass
+class QuantConfig:
+    NUM_CALIBRATION: int = 128     # slices used to calibrate the activation ranges
+    CALIBRATION_METHOD: str = 'Percentile' # 'MinMax', 'Entropy' or 'Percentile' (robust to outliers)
+    PER_CHANNEL: bool = True       # per-channel weight scales, much better accuracy for convs
+    DICE_BUDGET: float = 0.01      # largest accepted per-organ Dice drop (absolute) vs. fp32
+    BATCH_SIZE: int = 8
+
+
+ORGANS = {1: 'stomach', 2: 'small bowel', 3: 'large bowel'}
+
+
+# feeds normalized calibration batches to the onnx runtime calibrator
+class SliceCalibrationReader(CalibrationDataReader):
+    def __init__(self, paths, input_name, kind, batch_size=QuantConfig.BATCH_SIZE):
+        self.paths = paths
+        self.input_name = input_name
+        self.kind = kind
+        self.batch_size = batch_size
+        self.position = 0
+
+    def get_next(self):
+        if self.position >= len(self.paths):
+            return None
+        paths = self.paths[self.position:self.position + self.batch_size]
+        self.position += self.batch_size
+        images_clf, images_seg, _ = load_slices(paths, DatasetConfig.IMAGE_SIZE)
+        if self.kind == 'segmentation':
+            images = normalize_segmentation_batch(images_seg, DatasetConfig.MEAN, DatasetConfig.STD).numpy()
+        else:
+            images = normalize_classif_batch(images_clf, DatasetConfig.MEAN_CLF, DatasetConfig.STD_CLF)
+        return {self.input_name: images}
+
+    def rewind(self):
+        self.position = 0
+
+
+# static int8 quantization (QDQ format) of one onnx model, calibrated on the given slices
+def quantize_model(fp32_path, int8_path, calibration_paths, kind, config=None):
+    config = config or QuantConfig()
+    prepared_path = fp32_path.replace('.onnx', '.prep.onnx')
+    quant_pre_process(fp32_path, prepared_path)
+    input_name = make_session(prepared_path).get_inputs()[0].name
+    reader = SliceCalibrationReader(calibration_paths, input_name, kind, config.BATCH_SIZE)
+    quantize_static(
+        prepared_path, int8_path, reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=config.PER_CHANNEL,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=getattr(CalibrationMethod, config.CALIBRATION_METHOD),
+    )
+    os.remove(prepared_path)
+    print(f"{kind.capitalize()} model quantized to {int8_path}")
+
+
+# classification gate + segmentation of a set of slices, as in inference(); returns labels and the time spent
+def predict_labels(model, class_model, paths, batch_size=QuantConfig.BATCH_SIZE):
+    labels, elapsed = [], 0.0
+    for start_idx in range(0, len(paths), batch_size):
+        images_clf, images_seg, _ = load_slices(paths[start_idx:start_idx + batch_size], DatasetConfig.IMAGE_SIZE)
+        images_clf = normalize_classif_batch(images_clf, DatasetConfig.MEAN_CLF, DatasetConfig.STD_CLF)
+        images_norm = normalize_segmentation_batch(images_seg, DatasetConfig.MEAN, DatasetConfig.STD)
+        start = time.perf_counter()
+        batch_labels = np.zeros(images_norm.shape[:1] + images_norm.shape[2:], dtype=np.uint8)
+        true_idxs = np.where(classify_images(class_model, images_clf) > DatasetConfig.THR)[0]
+        if len(true_idxs) > 0:
+            batch_labels[true_idxs] = segment_images(model, images_norm[true_idxs], "cpu")
+        elapsed += time.perf_counter() - start
+        labels.append(batch_labels)
+    return np.concatenate(labels), elapsed
+
+
+# ground truth label masks (written by prepare_data_model_evaluation.py under the same file name),
+# resized like the model input
+def load_masks(paths, masks_dir):
+    masks = []
+    for path in paths:
+        mask = cv2.imread(os.path.join(masks_dir, os.path.basename(path)), cv2.IMREAD_GRAYSCALE)
+        masks.append(cv2.resize(mask, DatasetConfig.IMAGE_SIZE, interpolation=cv2.INTER_NEAREST))
+    return np.stack(masks)
+
+
+# Dice of each organ over the whole set of slices
+def dice_per_organ(pred, target):
+    scores = {}
+    for class_id, organ in ORGANS.items():
+        p, t = pred == class_id, target == class_id
+        denominator = p.sum() + t.sum()
+        scores[organ] = float(2.0 * np.logical_and(p, t).sum() / denominator) if denominator else 1.0
+    return scores
+
+
+# latency and accuracy of the int8 models against the fp32 ones, written to QUANT_REPORT_PATH
+def evaluate(paths, masks_dir=None, config=None):
+    config = config or QuantConfig()
+    fp32 = OnnxSegmenter(SEG_ONNX_PATH), OnnxClassifier(CLASS_ONNX_PATH)
+    int8 = OnnxSegmenter(SEG_INT8_PATH), OnnxClassifier(CLASS_INT8_PATH)
+
+    # one untimed pass each, so the session set-up doesn't count
+    predict_labels(*fp32, paths[:config.BATCH_SIZE])
+    predict_labels(*int8, paths[:config.BATCH_SIZE])
+    labels_fp32, time_fp32 = predict_labels(*fp32, paths, config.BATCH_SIZE)
+    labels_int8, time_int8 = predict_labels(*int8, paths, config.BATCH_SIZE)
+
+    # against the ground truth when there is one, otherwise against the fp32 predictions
+    target = load_masks(paths, masks_dir) if masks_dir else labels_fp32
+    dice_fp32 = dice_per_organ(labels_fp32, target)
+    dice_int8 = dice_per_organ(labels_int8, target)
+    dice_delta = {organ: dice_int8[organ] - dice_fp32[organ] for organ in ORGANS.values()}
+    accepted = all(delta >= -config.DICE_BUDGET for delta in dice_delta.values())
+
+    report = {
+        'num_slices': len(paths),
+        'reference': 'ground truth' if masks_dir else 'fp32 predictions',
+        'latency_fp32_ms_per_slice': 1000 * time_fp32 / len(paths),
+        'latency_int8_ms_per_slice': 1000 * time_int8 / len(paths),
+        'speedup': time_fp32 / time_int8,
+        'dice_fp32': dice_fp32,
+        'dice_int8': dice_int8,
+        'dice_delta': dice_delta,
+        'dice_budget': config.DICE_BUDGET,
+        'accepted': accepted,
+        'digests': {SEG_INT8_PATH: file_hash(SEG_INT8_PATH), CLASS_INT8_PATH: file_hash(CLASS_INT8_PATH)},
+    }
+    with open(QUANT_REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Latency: {report['latency_fp32_ms_per_slice']:.1f} -> {report['latency_int8_ms_per_slice']:.1f} ms/slice "
+          f"({report['speedup']:.2f}x)")
+    for organ in ORGANS.values():
+        print(f"Dice {organ}: fp32 {dice_fp32[organ]:.4f}, int8 {dice_int8[organ]:.4f} ({dice_delta[organ]:+.4f})")
+    print(f"int8 backend {'ACCEPTED' if accepted else 'REJECTED'} (budget {config.DICE_BUDGET}), report in {QUANT_REPORT_PATH}")
+    return report
+
+
+def main(images_dir, masks_dir, num_calibration, dice_budget, skip_quantize):
+    config = QuantConfig(NUM_CALIBRATION=num_calibration, DICE_BUDGET=dice_budget)
+    paths = sorted(glob.glob(os.path.join(images_dir, '*.png')))
+    if not paths:
+        print(f"No slices found in {images_dir}.")
+        return
+
+    # calibrate on an evenly spread subset, so every case and every part of the body is represented
+    calibration_paths = paths[::max(1, len(paths) // config.NUM_CALIBRATION)][:config.NUM_CALIBRATION]
+    if not skip_quantize:
+        quantize_model(SEG_ONNX_PATH, SEG_INT8_PATH, calibration_paths, 'segmentation', config)
+        quantize_model(CLASS_ONNX_PATH, CLASS_INT8_PATH, calibration_paths, 'classification', config)
+    evaluate(paths, masks_dir, config)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser()
+    # Define input parameters
+    parser.add_argument("-images_dir", type=str, default='output/test/images', help="Slices written by prepare_data_model_evaluation.py (default 'output/test/images')")
+    parser.add_argument("-masks_dir", type=str, default=None, help="Matching ground truth masks (default: compare against the fp32 predictions)")
+    parser.add_argument("-num_calibration", type=int, default=QuantConfig.NUM_CALIBRATION, help=f"Number of calibration slices (default {QuantConfig.NUM_CALIBRATION})")
+    parser.add_argument("-dice_budget", type=float, default=QuantConfig.DICE_BUDGET, help=f"Largest accepted per-organ Dice drop (default {QuantConfig.DICE_BUDGET})")
+    parser.add_argument("-skip_quantize", action="store_true", help="Only evaluate existing int8 models")
+
+    args = parser.parse_args()
+    main(args.images_dir, args.masks_dir, args.num_calibration, args.dice_budget, args.skip_quantize)
@@ -0,0 +1,828 @@
+import {
+	BufferAttribute,
+	BufferGeometry,
+	DoubleSide,
+	FileLoader,
+	FrontSide,
+	Group,
+	Line,
+	LineBasicMaterial,
+	LineLoop,
+	LineSegments,
+	LinearSRGBColorSpace,
+	Loader,
+	LoaderUtils,
+	Matrix4,
+	Mesh,
+	MeshBasicMaterial,
+	MeshStandardMaterial,
+	Object3D,
+	Points,
+	PointsMaterial,
+	TriangleFanDrawMode,
+	TriangleStripDrawMode
+} from '/static/three.module.js';
+import { toTrianglesDrawMode } from '/static/BufferGeometryUtils.js';
+
+/**
+ * glTF 2.0 loader with the interface of three's GLTFLoader (load / parse / parseAsync, the result's scene and
+ * scenes). It covers the geometry part of the format: binary (.glb) and JSON files, embedded, data-uri or
+ * external buffers, interleaved and sparse accessors, every primitive mode, the node hierarchy and
+ * metallic-roughness materials (factors only, textures are skipped), plus KHR_mesh_quantization and
+ * KHR_materials_unlit. Animations, skins, morph targets and cameras are not read.
+ */
+
+const BINARY_EXTENSION_HEADER_MAGIC = 'glTF';
+const BINARY_EXTENSION_HEADER_LENGTH = 12;
+const BINARY_EXTENSION_CHUNK_TYPES = { JSON: 0x4E4F534A, BIN: 0x004E4942 };
+
+const EXTENSIONS = {
+	KHR_MATERIALS_UNLIT: 'KHR_materials_unlit',
+	KHR_MESH_QUANTIZATION: 'KHR_mesh_quantization'
+};
+
+const WEBGL_CONSTANTS = {
+	POINTS: 0,
+	LINES: 1,
+	LINE_LOOP: 2,
+	LINE_STRIP: 3,
+	TRIANGLES: 4,
+	TRIANGLE_STRIP: 5,
+	TRIANGLE_FAN: 6
+};
+
+const WEBGL_COMPONENT_TYPES = {
+	5120: Int8Array,
+	5121: Uint8Array,
+	5122: Int16Array,
+	5123: Uint16Array,
+	5125: Uint32Array,
+	5126: Float32Array
+};
+
+const WEBGL_TYPE_SIZES = {
+	'SCALAR': 1,
+	'VEC2': 2,
+	'VEC3': 3,
+	'VEC4': 4,
+	'MAT2': 4,
+	'MAT3': 9,
+	'MAT4': 16
+};
+
+const ATTRIBUTES = {
+	POSITION: 'position',
+	NORMAL: 'normal',
+	TANGENT: 'tangent',
+	TEXCOORD_0: 'uv',
+	TEXCOORD_1: 'uv1',
+	TEXCOORD_2: 'uv2',
+	TEXCOORD_3: 'uv3',
+	COLOR_0: 'color',
+	WEIGHTS_0: 'skinWeight',
+	JOINTS_0: 'skinIndex'
+};
+
+class GLTFLoader extends Loader {
+
+	constructor( manager ) {
+
+		super( manager );
+
+	}
+
+	load( url, onLoad, onProgress, onError ) {
+
+		const scope = this;
+
+		let resourcePath;
+
+		if ( this.resourcePath !== '' ) {
+
+			resourcePath = this.resourcePath;
+
+		} else if ( this.path !== '' ) {
+
+			const relativeUrl = LoaderUtils.extractUrlBase( url );
+			resourcePath = LoaderUtils.resolveURL( relativeUrl, this.path );
+
+		} else {
+
+			resourcePath = LoaderUtils.extractUrlBase( url );
+
+		}
+
+		// Tells the LoadingManager to track an extra item, which resolves after
+		// the model is fully loaded. This means the count of items loaded will
+		// be incorrect, but ensures manager.onLoad() does not fire early.
+		this.manager.itemStart( url );
+
+		const _onError = function ( e ) {
+
+			if ( onError ) {
+
+				onError( e );
+
+			} else {
+
+				console.error( e );
+
+			}
+
+			scope.manager.itemError( url );
+			scope.manager.itemEnd( url );
+
+		};
+
+		const loader = new FileLoader( this.manager );
+
+		loader.setPath( this.path );
+		loader.setResponseType( 'arraybuffer' );
+		loader.setRequestHeader( this.requestHeader );
+		loader.setWithCredentials( this.withCredentials );
+
+		loader.load( url, function ( data ) {
+
+			try {
+
+				scope.parse( data, resourcePath, function ( gltf ) {
+
+					onLoad( gltf );
+
+					scope.manager.itemEnd( url );
+
+				}, _onError );
+
+			} catch ( e ) {
+
+				_onError( e );
+
+			}
+
+		}, onProgress, _onError );
+
+	}
+
+	parse( data, path, onLoad, onError ) {
+
+		let json;
+		let body = null;
+
+		if ( typeof data === 'string' ) {
+
+			json = JSON.parse( data );
+
+		} else if ( data instanceof ArrayBuffer ) {
+
+			const magic = new TextDecoder().decode( new Uint8Array( data, 0, 4 ) );
+
+			if ( magic === BINARY_EXTENSION_HEADER_MAGIC ) {
+
+				try {
+
+					( { json, body } = parseBinary( data ) );
+
+				} catch ( error ) {
+
+					if ( onError ) onError( error );
+					return;
+
+				}
+
+			} else {
+
+				json = JSON.parse( new TextDecoder().decode( data ) );
+
+			}
+
+		} else {
+
+			json = data;
+
+		}
+
+		if ( json.asset === undefined || json.asset.version[ 0 ] < 2 ) {
+
+			if ( onError ) onError( new Error( 'THREE.GLTFLoader: Unsupported asset. glTF versions >=2.0 are supported.' ) );
+			return;
+
+		}
+
+		const supported = Object.values( EXTENSIONS );
+
+		for ( const name of json.extensionsRequired || [] ) {
+
+			if ( ! supported.includes( name ) ) {
+
+				if ( onError ) onError( new Error( 'THREE.GLTFLoader: Unknown extension "' + name + '".' ) );
+				return;
+
+			}
+
+		}
+
+		const parser = new GLTFParser( json, body, {
+
+			path: path || this.resourcePath || '',
+			crossOrigin: this.crossOrigin,
+			requestHeader: this.requestHeader,
+			manager: this.manager,
+			withCredentials: this.withCredentials
+
+		} );
+
+		parser.parse( onLoad, onError );
+
+	}
+
+	parseAsync( data, path ) {
+
+		const scope = this;
+
+		return new Promise( function ( resolve, reject ) {
+
+			scope.parse( data, path, resolve, reject );
+
+		} );
+
+	}
+
+}
+
+/*********************************/
+/********** BINARY GLTF **********/
+/*********************************/
+
+function parseBinary( data ) {
+
+	const headerView = new DataView( data, 0, BINARY_EXTENSION_HEADER_LENGTH );
+	const version = headerView.getUint32( 4, true );
+	const length = headerView.getUint32( 8, true );
+
+	if ( version < 2.0 ) {
+
+		throw new Error( 'THREE.GLTFLoader: Legacy binary file detected.' );
+
+	}
+
+	const chunkView = new DataView( data, BINARY_EXTENSION_HEADER_LENGTH );
+	let chunkIndex = 0;
+	let content = null;
+	let body = null;
+
+	while ( chunkIndex < Math.min( length, data.byteLength ) - BINARY_EXTENSION_HEADER_LENGTH ) {
+
+		const chunkLength = chunkView.getUint32( chunkIndex, true );
+		chunkIndex += 4;
+
+		const chunkType = chunkView.getUint32( chunkIndex, true );
+		chunkIndex += 4;
+
+		if ( chunkType === BINARY_EXTENSION_CHUNK_TYPES.JSON ) {
+
+			const contentArray = new Uint8Array( data, BINARY_EXTENSION_HEADER_LENGTH + chunkIndex, chunkLength );
+			content = new TextDecoder().decode( contentArray );
+
+		} else if ( chunkType === BINARY_EXTENSION_CHUNK_TYPES.BIN ) {
+
+			const byteOffset = BINARY_EXTENSION_HEADER_LENGTH + chunkIndex;
+			body = data.slice( byteOffset, byteOffset + chunkLength );
+
+		}
+
+		// Clients must ignore chunks with unknown types.
+
+		chunkIndex += chunkLength;
+
+	}
+
+	if ( content === null ) {
+
+		throw new Error( 'THREE.GLTFLoader: JSON content not found.' );
+
+	}
+
+	return { json: JSON.parse( content ), body };
+
+}
+
+/*********************************/
+/********** INTERNALS ************/
+/*********************************/
+
+class GLTFParser {
+
+	constructor( json = {}, body = null, options = {} ) {
+
+		this.json = json;
+		this.body = body;
+		this.options = options;
+
+		// promises of the loaded buffers, buffer views, accessors, materials and geometries, by key
+		this.cache = new Map();
+
+	}
+
+	parse( onLoad, onError ) {
+
+		const json = this.json;
+
+		Promise.all( ( json.scenes || [] ).map( ( sceneDef, index ) => this.loadScene( index ) ) ).then( ( scenes ) => {
+
+			const scene = scenes[ json.scene || 0 ] || new Group();
+
+			onLoad( {
+				scene: scene,
+				scenes: scenes,
+				animations: [],
+				cameras: [],
+				asset: json.asset,
+				parser: this,
+				userData: {}
+			} );
+
+		} ).catch( onError );
+
+	}
+
+	cached( key, create ) {
+
+		if ( ! this.cache.has( key ) ) {
+
+			let value;
+
+			try {
+
+				value = create();
+
+			} catch ( error ) {
+
+				value = Promise.reject( error );
+
+			}
+
+			this.cache.set( key, value );
+
+		}
+
+		return this.cache.get( key );
+
+	}
+
+	loadBuffer( bufferIndex ) {
+
+		return this.cached( 'buffer:' + bufferIndex, () => {
+
+			const bufferDef = this.json.buffers[ bufferIndex ];
+
+			if ( bufferDef.type && bufferDef.type !== 'arraybuffer' ) {
+
+				throw new Error( 'THREE.GLTFLoader: ' + bufferDef.type + ' buffer type is not supported.' );
+
+			}
+
+			// If present, GLB container is required to be the first buffer.
+			if ( bufferDef.uri === undefined && bufferIndex === 0 ) {
+
+				if ( this.body === null ) throw new Error( 'THREE.GLTFLoader: Binary buffer is missing.' );
+				return Promise.resolve( this.body );
+
+			}
+
+			const options = this.options;
+			const loader = new FileLoader( options.manager );
+			loader.setResponseType( 'arraybuffer' );
+			loader.setRequestHeader( options.requestHeader );
+			loader.setWithCredentials( options.withCredentials );
+
+			return new Promise( function ( resolve, reject ) {
+
+				loader.load( LoaderUtils.resolveURL( bufferDef.uri, options.path ), resolve, undefined, function () {
+
+					reject( new Error( 'THREE.GLTFLoader: Failed to load buffer "' + bufferDef.uri + '".' ) );
+
+				} );
+
+			} );
+
+		} );
+
+	}
+
+	loadBufferView( bufferViewIndex ) {
+
+		return this.cached( 'bufferView:' + bufferViewIndex, () => {
+
+			const bufferViewDef = this.json.bufferViews[ bufferViewIndex ];
+
+			return this.loadBuffer( bufferViewDef.buffer ).then( function ( buffer ) {
+
+				const byteLength = bufferViewDef.byteLength || 0;
+				const byteOffset = bufferViewDef.byteOffset || 0;
+				return buffer.slice( byteOffset, byteOffset + byteLength );
+
+			} );
+
+		} );
+
+	}
+
+	loadAccessor( accessorIndex ) {
+
+		return this.cached( 'accessor:' + accessorIndex, () => {
+
+			const accessorDef = this.json.accessors[ accessorIndex ];
+			const itemSize = WEBGL_TYPE_SIZES[ accessorDef.type ];
+			const TypedArray = WEBGL_COMPONENT_TYPES[ accessorDef.componentType ];
+			const normalized = accessorDef.normalized === true;
+			const length = accessorDef.count * itemSize;
+
+			const pending = [ accessorDef.bufferView !== undefined ? this.loadBufferView( accessorDef.bufferView ) : null ];
+
+			if ( accessorDef.sparse !== undefined ) {
+
+				pending.push( this.loadBufferView( accessorDef.sparse.indices.bufferView ) );
+				pending.push( this.loadBufferView( accessorDef.sparse.values.bufferView ) );
+
+			}
+
+			return Promise.all( pending ).then( ( [ bufferView, indicesView, valuesView ] ) => {
+
+				let array;
+
+				if ( bufferView === null ) {
+
+					// Ignore empty accessors, which may be used to declare runtime
+					// information about attributes coming from another source (e.g. Draco
+					// compression extension).
+					array = new TypedArray( length );
+
+				} else {
+
+					const elementBytes = TypedArray.BYTES_PER_ELEMENT;
+					const byteOffset = accessorDef.byteOffset || 0;
+					const byteStride = this.json.bufferViews[ accessorDef.bufferView ].byteStride;
+
+					if ( byteStride && byteStride !== elementBytes * itemSize ) {
+
+						// interleaved: gathered into a packed array of this accessor alone
+						const source = new TypedArray( bufferView, 0, Math.floor( bufferView.byteLength / elementBytes ) );
+						array = new TypedArray( length );
+
+						for ( let i = 0; i < accessorDef.count; i ++ ) {
+
+							const start = ( byteOffset + i * byteStride ) / elementBytes;
+
+							for ( let k = 0; k < itemSize; k ++ ) {
+
+								array[ i * itemSize + k ] = source[ start + k ];
+
+							}
+
+						}
+
+					} else {
+
+						array = new TypedArray( bufferView, byteOffset, length );
+
+					}
+
+				}
+
+				if ( accessorDef.sparse !== undefined ) {
+
+					const sparse = accessorDef.sparse;
+					const SparseIndexArray = WEBGL_COMPONENT_TYPES[ sparse.indices.componentType ];
+					const sparseIndices = new SparseIndexArray( indicesView, sparse.indices.byteOffset || 0, sparse.count );
+					const sparseValues = new TypedArray( valuesView, sparse.values.byteOffset || 0, sparse.count * itemSize );
+
+					// the buffer view is shared, the sparse values go into a copy
+					if ( bufferView !== null ) array = array.slice();
+
+					for ( let i = 0; i < sparseIndices.length; i ++ ) {
+
+						array.set( sparseValues.subarray( i * itemSize, ( i + 1 ) * itemSize ), sparseIndices[ i ] * itemSize );
+
+					}
+
+				}
+
+				return new BufferAttribute( array, itemSize, normalized );
+
+			} );
+
+		} );
+
+	}
+
+	loadMaterial( materialIndex ) {
+
+		return this.cached( 'material:' + materialIndex, () => {
+
+			const materialDef = this.json.materials[ materialIndex ];
+			const extensions = materialDef.extensions || {};
+			const pbr = materialDef.pbrMetallicRoughness || {};
+
+			const material = extensions[ EXTENSIONS.KHR_MATERIALS_UNLIT ] !== undefined
+				? new MeshBasicMaterial() : new MeshStandardMaterial();
+
+			if ( Array.isArray( pbr.baseColorFactor ) ) {
+
+				const factor = pbr.baseColorFactor;
+				material.color.setRGB( factor[ 0 ], factor[ 1 ], factor[ 2 ], LinearSRGBColorSpace );
+				material.opacity = factor[ 3 ];
+
+			}
+
+			if ( material.isMeshStandardMaterial ) {
+
+				material.metalness = pbr.metallicFactor !== undefined ? pbr.metallicFactor : 1.0;
+				material.roughness = pbr.roughnessFactor !== undefined ? pbr.roughnessFactor : 1.0;
+
+				if ( Array.isArray( materialDef.emissiveFactor ) ) {
+
+					const factor = materialDef.emissiveFactor;
+					material.emissive.setRGB( factor[ 0 ], factor[ 1 ], factor[ 2 ], LinearSRGBColorSpace );
+
+				}
+
+			}
+
+			if ( pbr.baseColorTexture !== undefined || pbr.metallicRoughnessTexture !== undefined
+				|| materialDef.normalTexture !== undefined || materialDef.occlusionTexture !== undefined
+				|| materialDef.emissiveTexture !== undefined ) {
+
+				console.warn( 'THREE.GLTFLoader: Textures are not loaded, material "' + ( materialDef.name || materialIndex ) + '" uses its factors only.' );
+
+			}
+
+			if ( materialDef.doubleSided === true ) material.side = DoubleSide;
+
+			const alphaMode = materialDef.alphaMode || 'OPAQUE';
+
+			if ( alphaMode === 'BLEND' ) {
+
+				material.transparent = true;
+
+				// See: https://github.com/mrdoob/three.js/issues/17706
+				material.depthWrite = false;
+
+			} else {
+
+				material.transparent = false;
+
+				if ( alphaMode === 'MASK' ) {
+
+					material.alphaTest = materialDef.alphaCutoff !== undefined ? materialDef.alphaCutoff : 0.5;
+
+				}
+
+			}
+
+			if ( materialDef.name ) material.name = materialDef.name;
+
+			return Promise.resolve( material );
+
+		} );
+
+	}
+
+	// the default material of primitives without one
+	loadDefaultMaterial() {
+
+		return this.cached( 'material:default', () => Promise.resolve( new MeshStandardMaterial( {
+			color: 0xFFFFFF,
+			emissive: 0x000000,
+			metalness: 1,
+			roughness: 1,
+			transparent: false,
+			depthTest: true,
+			side: FrontSide
+		} ) ) );
+
+	}
+
+	loadGeometry( meshIndex, primitiveIndex ) {
+
+		return this.cached( 'geometry:' + meshIndex + ':' + primitiveIndex, () => {
+
+			const primitiveDef = this.json.meshes[ meshIndex ].primitives[ primitiveIndex ];
+			const geometry = new BufferGeometry();
+			const pending = [];
+
+			if ( primitiveDef.extensions && primitiveDef.extensions.KHR_draco_mesh_compression ) {
+
+				throw new Error( 'THREE.GLTFLoader: Draco compressed meshes are not supported.' );
+
+			}
+
+			for ( const gltfAttributeName in primitiveDef.attributes ) {
+
+				const threeAttributeName = ATTRIBUTES[ gltfAttributeName ] || gltfAttributeName.toLowerCase();
+
+				// Skip attributes already provided by e.g. Draco extension.
+				if ( threeAttributeName in geometry.attributes ) continue;
+
+				pending.push( this.loadAccessor( primitiveDef.attributes[ gltfAttributeName ] ).then( function ( accessor ) {
+
+					geometry.setAttribute( threeAttributeName, accessor );
+
+				} ) );
+
+			}
+
+			if ( primitiveDef.indices !== undefined && ! geometry.index ) {
+
+				pending.push( this.loadAccessor( primitiveDef.indices ).then( function ( accessor ) {
+
+					geometry.setIndex( accessor );
+
+				} ) );
+
+			}
+
+			if ( primitiveDef.targets !== undefined ) {
+
+				console.warn( 'THREE.GLTFLoader: Morph targets are not loaded.' );
+
+			}
+
+			return Promise.all( pending ).then( function () {
+
+				const mode = primitiveDef.mode !== undefined ? primitiveDef.mode : WEBGL_CONSTANTS.TRIANGLES;
+
+				if ( mode === WEBGL_CONSTANTS.TRIANGLE_STRIP ) {
+
+					return toTrianglesDrawMode( geometry, TriangleStripDrawMode );
+
+				} else if ( mode === WEBGL_CONSTANTS.TRIANGLE_FAN ) {
+
+					return toTrianglesDrawMode( geometry, TriangleFanDrawMode );
+
+				}
+
+				return geometry;
+
+			} );
+
+		} );
+
+	}
+
+	// the material of a primitive, adapted to its geometry (points, lines, vertex colors, no normals)
+	primitiveMaterial( material, geometry, mode ) {
+
+		const useVertexColors = geometry.attributes.color !== undefined;
+		const useFlatShading = geometry.attributes.normal === undefined;
+
+		if ( mode === WEBGL_CONSTANTS.POINTS ) {
+
+			const pointsMaterial = new PointsMaterial();
+			pointsMaterial.color.copy( material.color );
+			pointsMaterial.opacity = material.opacity;
+			pointsMaterial.transparent = material.transparent;
+			pointsMaterial.sizeAttenuation = false;
+			pointsMaterial.vertexColors = useVertexColors;
+			return pointsMaterial;
+
+		}
+
+		if ( mode === WEBGL_CONSTANTS.LINES || mode === WEBGL_CONSTANTS.LINE_STRIP || mode === WEBGL_CONSTANTS.LINE_LOOP ) {
+
+			const lineMaterial = new LineBasicMaterial();
+			lineMaterial.color.copy( material.color );
+			lineMaterial.opacity = material.opacity;
+			lineMaterial.transparent = material.transparent;
+			lineMaterial.vertexColors = useVertexColors;
+			return lineMaterial;
+
+		}
+
+		if ( useVertexColors || ( useFlatShading && ! material.isMeshBasicMaterial ) ) {
+
+			return this.cached( 'variant:' + material.uuid + ':' + useVertexColors + ':' + useFlatShading, function () {
+
+				const variant = material.clone();
+				variant.vertexColors = useVertexColors;
+				if ( ! material.isMeshBasicMaterial ) variant.flatShading = useFlatShading;
+				return variant;
+
+			} );
+
+		}
+
+		return material;
+
+	}
+
+	// a new object per call (a mesh used by several nodes shares its geometries and materials)
+	loadMesh( meshIndex ) {
+
+		const meshDef = this.json.meshes[ meshIndex ];
+
+		return Promise.all( meshDef.primitives.map( ( primitiveDef, primitiveIndex ) => Promise.all( [
+			this.loadGeometry( meshIndex, primitiveIndex ),
+			primitiveDef.material !== undefined ? this.loadMaterial( primitiveDef.material ) : this.loadDefaultMaterial()
+		] ) ) ).then( ( loaded ) => {
+
+			const meshes = loaded.map( ( [ geometry, material ], primitiveIndex ) => {
+
+				const primitiveDef = meshDef.primitives[ primitiveIndex ];
+				const mode = primitiveDef.mode !== undefined ? primitiveDef.mode : WEBGL_CONSTANTS.TRIANGLES;
+				material = this.primitiveMaterial( material, geometry, mode );
+
+				let mesh;
+
+				if ( mode === WEBGL_CONSTANTS.POINTS ) {
+
+					mesh = new Points( geometry, material );
+
+				} else if ( mode === WEBGL_CONSTANTS.LINES ) {
+
+					mesh = new LineSegments( geometry, material );
+
+				} else if ( mode === WEBGL_CONSTANTS.LINE_STRIP ) {
+
+					mesh = new Line( geometry, material );
+
+				} else if ( mode === WEBGL_CONSTANTS.LINE_LOOP ) {
+
+					mesh = new LineLoop( geometry, material );
+
+				} else {
+
+					mesh = new Mesh( geometry, material );
+
+				}
+
+				mesh.name = meshDef.name ? meshDef.name + ( primitiveIndex > 0 ? '_' + primitiveIndex : '' ) : 'mesh_' + meshIndex;
+				return mesh;
+
+			} );
+
+			if ( meshes.length === 1 ) return meshes[ 0 ];
+
+			const group = new Group();
+			for ( const mesh of meshes ) group.add( mesh );
+			return group;
+
+		} );
+
+	}
+
+	loadNode( nodeIndex ) {
+
+		const nodeDef = this.json.nodes[ nodeIndex ];
+
+		const pending = [ nodeDef.mesh !== undefined ? this.loadMesh( nodeDef.mesh ) : Promise.resolve( new Object3D() ) ];
+
+		for ( const childIndex of nodeDef.children || [] ) {
+
+			pending.push( this.loadNode( childIndex ) );
+
+		}
+
+		return Promise.all( pending ).then( function ( [ node, ...children ] ) {
+
+			if ( nodeDef.name ) node.name = nodeDef.name;
+
+			if ( nodeDef.matrix !== undefined ) {
+
+				const matrix = new Matrix4();
+				matrix.fromArray( nodeDef.matrix );
+				node.applyMatrix4( matrix );
+
+			} else {
+
+				if ( nodeDef.translation !== undefined ) node.position.fromArray( nodeDef.translation );
+				if ( nodeDef.rotation !== undefined ) node.quaternion.fromArray( nodeDef.rotation );
+				if ( nodeDef.scale !== undefined ) node.scale.fromArray( nodeDef.scale );
+
+			}
+
+			for ( const child of children ) node.add( child );
+
+			return node;
+
+		} );
+
+	}
+
+	loadScene( sceneIndex ) {
+
+		const sceneDef = this.json.scenes[ sceneIndex ];
+
+		return Promise.all( ( sceneDef.nodes || [] ).map( ( nodeIndex ) => this.loadNode( nodeIndex ) ) ).then( function ( nodes ) {
+
+			const scene = new Group();
+			if ( sceneDef.name ) scene.name = sceneDef.name;
+			for ( const node of nodes ) scene.add( node );
+			return scene;
+
+		} );
+
+	}
+
+}
+
+export { GLTFLoader };
@@ -0,0 +1,51 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+from cache import ResultCache, MeshCache
+
+
+class TestCaches(unittest.TestCase):
+    def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self.folder = self._folder.name
+
+    def tearDown(self):
+        self._folder.cleanup()
+
+    def test_result_round_trip(self):
+        cache = ResultCache(os.path.join(self.folder, 'results.db'))
+        labels = np.random.default_rng(0).integers(0, 4, (20, 30), dtype=np.uint8)
+        cache.put_many([('a', 0.75, labels)])
+        found = cache.get_many(['a', 'b'])
+        self.assertEqual(list(found), ['a'])
+        self.assertEqual(found['a'][0], 0.75)
+        np.testing.assert_array_equal(found['a'][1], labels)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_mesh_round_trip(self):
+        cache = MeshCache(os.path.join(self.folder, 'meshes.db'))
+        vertices = np.random.default_rng(0).random((10, 3), dtype=np.float32)
+        faces = np.arange(12, dtype=np.int32).reshape(-1, 3) % 10
+        cache.put_many([('a', vertices, faces)])
+        found_vertices, found_faces = cache.get_many(['a'])['a']
+        np.testing.assert_array_equal(found_vertices, vertices)
+        np.testing.assert_array_equal(found_faces, faces)
+
+    def test_least_recently_used_go_first(self):
+        rng = np.random.default_rng(0)
+        labels = [rng.integers(0, 256, (32, 32), dtype=np.uint8) for _ in range(3)]  # incompressible, ~1 kB each
+        cache = ResultCache(os.path.join(self.folder, 'results.db'), max_bytes=2500)
+        cache.put_many([('a', 0.0, labels[0]), ('b', 0.0, labels[1])])
+        cache.get_many(['a'])  # b is now the least recently used
+        cache.put_many([('c', 0.0, labels[2])])
+        self.assertEqual(sorted(cache.get_many(['a', 'b', 'c'])), ['a', 'c'])
+
+        # the rows survive a reopen
+        reopened = ResultCache(cache.path, cache.max_bytes)
+        self.assertEqual(sorted(reopened.get_many(['a', 'b', 'c'])), ['a', 'c'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from scipy.ndimage import binary_closing, gaussian_filter
+from skimage.morphology import ball
+
+import threed
+from cache import MeshCache
+
+
+# a small study of two ellipsoid organs, long enough in z for several slabs
+def synthetic_volume(shape=(36, 72, 72)):
+    z, y, x = np.indices(shape)
+    label_volume = np.zeros(shape, dtype=np.uint8)
+    label_volume[((z - 15) / 10) ** 2 + ((y - 30) / 18) ** 2 + ((x - 28) / 14) ** 2 < 1] = 1
+    label_volume[((z - 22) / 12) ** 2 + ((y - 45) / 12) ** 2 + ((x - 48) / 16) ** 2 < 1] = 2
+    return label_volume
+
+
+# the triangles of a mesh as a sorted list of vertex triples, whatever the vertex and face order
+def triangles(mesh, decimals=4):
+    vertices, faces = mesh
+    return sorted(tuple(sorted(map(tuple, tri))) for tri in np.round(vertices[faces], decimals).tolist())
+
+
+class TestFormat(unittest.TestCase):
+    def assert_formats_like_python(self, values, decimals):
+        chars = threed.format_columns(values, decimals)
+        cells = [cell.tobytes().decode().strip() for cell in chars.reshape(-1, chars.shape[-1])]
+        self.assertEqual(cells, [f'{float(x):.{decimals}f}' for x in values.reshape(-1)])
+
+    def test_decimals(self):
+        rng = np.random.default_rng(0)
+        special = [0.0, -0.0, 1e-5, -1e-5, -0.00004, 0.00005, 0.25, -0.75, -0.5,
+                   9999.99996, 10000.0, -12345.6789, 123456.5]
+        for dtype in (np.float32, np.float64):
+            for decimals in (1, 4, 6):
+                values = np.concatenate([special, rng.uniform(-300, 300, 2000), rng.uniform(-2e5, 2e5, 200)])
+                self.assert_formats_like_python(values.astype(dtype), decimals)
+
+    def test_integers(self):
+        values = np.array([0, 1, 9, 10, 9999, 10000, 10001, 123456789, 2 ** 32 + 5], dtype=np.int64)
+        chars = threed.format_columns(values)
+        cells = [cell.tobytes().decode().strip() for cell in chars]
+        self.assertEqual(cells, [str(i) for i in values])
+        self.assertEqual(len(set(map(len, chars))), 1)
+
+    def test_digits(self):
+        values = np.array([0, 7, 42, 9999, 10000, 123456], dtype=np.int64)
+        out = np.zeros((len(values), 8), dtype=np.uint8)
+        threed._digits(values, out)
+        self.assertEqual([row.tobytes().decode() for row in out], [f'{i:>8}' for i in values])
+        threed._digits(values, out, blank=False)
+        self.assertEqual([row.tobytes().decode() for row in out], [f'{i:08}' for i in values])
+
+    def test_lines(self):
+        rows = np.array([[-1.5, 0.0, 10000.25], [2.0, -0.0, -3e-5]], dtype=np.float32)
+        lines = threed.format_lines('v', rows, 4, chunk_size=1).decode().splitlines()
+        self.assertEqual([line.split() for line in lines],
+                         [['v'] + [f'{float(x):.4f}' for x in row] for row in rows])
+        faces = np.array([[1, 2, 3], [10000, 99999, 123456]], dtype=np.int64)
+        lines = threed.format_lines('f', faces).decode().splitlines()
+        self.assertEqual([line.split() for line in lines], [['f'] + [str(i) for i in row] for row in faces])
+
+
+# the ball of `radius` mm in voxels of `spacing` (an ellipsoid when anisotropic), for binary_closing()
+def ball_structure(radius, spacing):
+    reach = [int(radius // voxel) for voxel in spacing]
+    offsets = np.indices([2 * r + 1 for r in reach])
+    dist2 = sum(((offsets[axis] - reach[axis]) * spacing[axis]) ** 2 for axis in range(3))
+    return dist2 <= radius ** 2 + 1e-6
+
+
+class TestClosing(unittest.TestCase):
+    def test_matches_binary_closing(self):
+        rng = np.random.default_rng(0)
+        # blobs with holes and gaps, and scattered single voxels
+        mask = gaussian_filter(rng.random((20, 24, 22)), 1.5) > 0.52
+        mask |= rng.random(mask.shape) > 0.97
+        for spacing in ((1.0, 1.0, 1.0), (0.8, 1.2, 2.0), (2.5, 1.0, 1.0)):
+            for radius in (1.0, 2.0, 3.0, 4.5):
+                structure = ball_structure(radius, spacing)
+                if spacing == (1.0, 1.0, 1.0) and radius.is_integer():
+                    np.testing.assert_array_equal(structure, ball(int(radius)).astype(bool))
+                expected = binary_closing(mask, structure=structure)
+                with self.subTest(spacing=spacing, radius=radius):
+                    np.testing.assert_array_equal(threed.close_volume_separable(mask, radius, spacing), expected)
+                    np.testing.assert_array_equal(threed.close_volume_edt(mask, radius, spacing), expected)
+
+    def test_empty(self):
+        mask = np.zeros((6, 7, 8), dtype=bool)
+        self.assertFalse(threed.close_volume_separable(mask, 2.0, (1.0, 1.0, 2.0)).any())
+        self.assertFalse(threed.close_volume_edt(mask, 2.0, (1.0, 1.0, 2.0)).any())
+
+
+class TestMeshOrgans(unittest.TestCase):
+    spacing = (1.5, 1.5, 3.0)
+
+    def test_slabs_match_whole_organs(self):
+        label_volume = synthetic_volume()
+        whole = threed.mesh_organs(label_volume, 2, self.spacing, threed.MeshConfig(SLAB_SIZE=0), workers=1)
+        slabs = threed.mesh_organs(label_volume, 2, self.spacing, threed.MeshConfig(SLAB_SIZE=32), workers=2)
+        for whole_mesh, slab_mesh in zip(whole, slabs):
+            self.assertGreater(len(whole_mesh[1]), 0)
+            self.assertEqual(triangles(whole_mesh), triangles(slab_mesh))
+
+    def test_cached_slabs_match(self):
+        label_volume = synthetic_volume()
+        config = threed.MeshConfig(SLAB_SIZE=32)
+        with tempfile.TemporaryDirectory() as folder:
+            cache = MeshCache(os.path.join(folder, 'mesh_cache.db'))
+            first = threed.mesh_organs(label_volume, 2, self.spacing, config, workers=1, cache=cache)
+            second = threed.mesh_organs(label_volume, 2, self.spacing, config, workers=1, cache=cache)
+            cache._conn.close()
+        self.assertGreater(cache.hits, 0)
+        for first_mesh, second_mesh in zip(first, second):
+            self.assertEqual(triangles(first_mesh), triangles(second_mesh))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,160 +1,1096 @@
 import os
+import re
+import gzip
+import json
+import struct
+import hashlib
+import tempfile
+import threading
+import traceback
+import tracemalloc
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from skimage import measure
 from skimage.morphology import ball
 from PIL import Image
-from scipy.ndimage import zoom, binary_closing
+from scipy.ndimage import affine_transform, binary_closing, distance_transform_edt, gaussian_filter, label
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
 
+from cache import CacheConfig, MeshCache
+from writer import get_executor
+from decimate import mesh_lods
 
-# load images from a specified 'overlaid' folder (passed as argument)
-def load_images_from_folder(folder, prefix):
-    images = []
+
+# mask files written by the inference writer (png, lossless webp or raw npy)
+MASK_EXTENSIONS = ('.png', '.webp', '.npy')
+
+# slices kept around each organ when it is cropped out of the volume: covers the reach of the cubic
+# spline (its ringing), of the closing (twice the ball radius, after zooming) and of marching cubes
+ROI_PADDING = 8
+
+# threads meshing the organs side by side (1: mesh them one after another in the calling thread)
+MESH_WORKERS = min(3, os.cpu_count() or 1)
+
+# class for 3D rendering configuration
+@dataclass
+class MeshConfig:
+    PIXEL_SPACING: float = 1.5     # in-plane spacing (mm) when the file names don't give it
+    SLICE_THICKNESS: float = 3.0   # spacing (mm) between slices, never in the file names
+    RESAMPLE_METHOD: str = 'sdf'   # 'sdf' (signed distance), 'smooth' (blurred mask) or 'spline' (the mask itself)
+    RESAMPLE_ORDER: int = 1        # spline order of the resampling ('spline' with order 3 is the original path)
+    SMOOTH_SIGMA: float = 0.5      # blur (input voxels) of the 'smooth' method
+    CLOSING_RADIUS: float = 3.0    # radius (mm) of the ball used by the closing (2 voxels at 1.5 mm)
+    CLOSING_METHOD: str = 'separable' # 'separable', 'edt' (distance transforms) or 'ball' (binary_closing)
+    GLB_QUANTIZE: bool = True      # 16-bit positions and 8-bit normals in the .glb (KHR_mesh_quantization)
+    OBJ_DECIMALS: int = 4          # decimals of the .obj vertex coordinates
+    OBJ_GZIP_LEVEL: int = 1        # compression of the .obj.gz written next to the .obj (0: no .obj.gz)
+    SLAB_SIZE: int = 32            # resampled slices meshed per z-slab (0: every organ in one piece)
+    SLAB_CACHE: bool = True        # reuse the meshes of the slabs whose labels didn't change
+    OUT_OF_CORE: bool = True       # keep the label volume in a memory-mapped scratch file instead of in RAM
+    SCRATCH_DIR: str = ''          # folder of the scratch files ('': the system temp folder)
+    MEMORY_REPORT: bool = False    # print the peak memory of every step (all steps then run in the calling thread)
+    PRUNE_MIN_VOLUME: float = 100.0 # connected fragments of an organ smaller than this (mm3) are dropped (0: none)
+    PRUNE_KEEP_LARGEST: int = 0    # keep only the N largest fragments of every organ (0: no limit)
+    LOD_TRIANGLES: tuple = (20000, 5000, 1000) # triangle budget of each organ at every level of detail (() for none)
+    LOD_SMOOTHING: int = 10        # Taubin smoothing iterations of the simplified levels (0: none)
+    LOD_OBJ: bool = True           # the coarsest level also as .lod<k>.obj/.mtl (downloads, VR headsets)
+    PREVIEW_STEP: int = 2          # in-plane subsampling of the label volume meshed for the preview
+
+
+# spacing part of the UW-Madison slice names: slice_<idx>_<width>_<height>_<spacing x>_<spacing y>
+SPACING_PATTERN = re.compile(r'slice_\d+_\d+_\d+_(\d+(?:\.\d+)?)_(\d+(?:\.\d+)?)')
+
+# mesh color of every organ
+MESH_COLORS = [[.976, 0.733, 0.749],   # light pink
+               [1.0, 0.50, 0.64],      # medium pink
+               [0.72, 0.32, 0.40]]     # dark pink
+
+
+# peak memory of every step of the mesh build, recorded while the report is open (the mesh threads are then
+# left out, steps run side by side would mix). numpy arrays are traced like any other allocation, the pages
+# of memory-mapped files are not.
+class MemoryReport:
+    def __init__(self):
+        self.peaks = {}
+
+    def __enter__(self):
+        global _memory_report
+        tracemalloc.start()
+        _memory_report = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _memory_report
+        _memory_report = None
+        tracemalloc.stop()
+
+    def print(self):
+        print(f"{'step':<16} {'peak (MB)':>10}")
+        for step, peak in self.peaks.items():
+            print(f"{step:<16} {peak / 2 ** 20:>10.1f}")
+
+
+_memory_report = None
+
+
+# record the memory in use at the peak of a step (the largest over all its runs), when a report is open
+@contextmanager
+def memory_stage(name):
+    report = _memory_report
+    if report is None:
+        yield
+        return
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        report.peaks[name] = max(report.peaks.get(name, 0), tracemalloc.get_traced_memory()[1])
+
+
+# mask files of a study in a specified 'overlaid' folder (passed as argument), in slice order
+def mask_files(folder, prefix):
     if not os.path.exists(folder):
         print("The specified folder does not exist.")
-        return images
+        return []
     # Split prefix into parts
     prefix_parts = prefix.split('_')
-    for filename in sorted(os.listdir(folder)):
-        if filename.startswith(f'{prefix_parts[0]}_{prefix_parts[1]}') and filename.endswith(f'{prefix_parts[2]}_mask.png'):
-            img_path = os.path.join(folder, filename)
-            try:
-                with Image.open(img_path) as img:
-                    images.append(np.array(img))
-            except IOError:
-                print(f"Failed to load {filename}.")
-    return images
-
-    
-# step 1: extract the color channels into 3D volumes
-def extract_organ_masks(images, organ_colors):
-    # Initialize a list of volumes for each organ color
-    organ_volumes = [np.zeros((images[0].shape[0], images[0].shape[1]), dtype=bool) for _ in organ_colors]
-    
-    for img in images:
-        for idx, color in enumerate(organ_colors):
-            # Create a mask where the image matches the specific organ color
-            mask = np.all(img == np.array(color, dtype=img.dtype), axis=-1)
-            # Stack the mask to build a 3D volume for each organ
-            organ_volumes[idx] = np.dstack((organ_volumes[idx], mask))
-    
-    return organ_volumes
-
-
-# step 2: interpolate 3D volumes from masks
-def interpolate_volumes(volumes, scale_factor):
-    return [zoom(volume, (1, 1, scale_factor), order=3) for volume in volumes]
-
-
-# step 3: apply morphological closing to 3D volumes from masks
-def close_volumes(volumes, size=2):
-    structure = ball(size)
-    return [binary_closing(volume, structure=structure) for volume in volumes]
-
-
-# step 4: extract mesh from 3D volumes from masks
-def extract_mesh_from_volumes(volumes):
-    vertices_list = []
-    faces_list = []
-    colors_list = []  # Initialize colors list
-    colors = [[.976, 0.733, 0.749],   # light pink
-              [1.0, 0.50, 0.64],     # medium pink
-              [0.72, 0.32, 0.40]]     # dark pink
-    color_index = 0  
-
-    # Calculate overall center of all organs combined
-    overall_center = np.zeros(3, dtype=np.float64)
-    total_verts_count = 0
+    mask_suffixes = tuple(f'{prefix_parts[2]}_mask{ext}' for ext in MASK_EXTENSIONS)
+    return [os.path.join(folder, filename) for filename in sorted(os.listdir(folder))
+            if filename.startswith(f'{prefix_parts[0]}_{prefix_parts[1]}') and filename.endswith(mask_suffixes)]
+
+
+# rgb mask of a file, None when it can't be read
+def load_mask(img_path):
+    try:
+        # raw masks are stored in the same channel order PIL reads back from the images
+        if img_path.endswith('.npy'):
+            return np.load(img_path)
+        with Image.open(img_path) as img:
+            return np.array(img)
+    except (IOError, ValueError):
+        print(f"Failed to load {os.path.basename(img_path)}.")
+        return None
+
+
+# load images from a specified 'overlaid' folder (passed as argument)
+def load_images_from_folder(folder, prefix):
+    images = (load_mask(img_path) for img_path in mask_files(folder, prefix))
+    return [img for img in images if img is not None]
+
+
+# (slices, H, W) uint8 volume in a scratch file of `directory` (the system temp folder when empty): only the
+# slices being worked on are paged in. delete the file once done.
+def scratch_volume(shape, directory=''):
+    fd, path = tempfile.mkstemp(suffix='.labels', dir=directory or None)
+    os.close(fd)
+    return np.memmap(path, dtype=np.uint8, mode='w+', shape=tuple(shape))
+
+
+# a zeroed (slices, H, W) label volume for predict() to fill: with OUT_OF_CORE a scratch_volume(), which
+# threed_render(..., owned=True) then prunes in place and deletes after the build
+def new_label_volume(shape, config=None):
+    config = config or MeshConfig()
+    if config.OUT_OF_CORE and np.prod(shape):
+        return scratch_volume(shape, config.SCRATCH_DIR)
+    return np.zeros(shape, dtype=np.uint8)
+
+
+# the file of a whole scratch volume (not of a part of it), None for any other array
+def _scratch_path(volume):
+    if not isinstance(volume, np.memmap) or not volume.filename or volume.offset:
+        return None
+    return volume.filename if volume.nbytes == os.path.getsize(volume.filename) else None
+
+
+# pack (..., 3) uint8 rgb pixels into uint32 keys, so a color is compared as a single number
+def pack_rgb(pixels):
+    pixels = pixels.astype(np.uint32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+# step 1: map the rgb masks to a (slices, H, W) uint8 label volume, preallocated and filled one slice at a
+# time with a single lookup of the packed colors (organ i of organ_colors is class id i + 1, anything else 0).
+# with `out` (a zeroed volume, e.g. a scratch_volume()), `images` can be any iterable of masks, read one at a
+# time; masks that couldn't be read (None) leave their slice empty.
+def build_label_volume(images, organ_colors, out=None):
+    color_keys = pack_rgb(np.array(organ_colors, dtype=np.uint8))
+    order = np.argsort(color_keys)
+    sorted_keys = color_keys[order]
+    class_ids = (order + 1).astype(np.uint8)
+
+    label_volume = out if out is not None else np.zeros((len(images),) + images[0].shape[:2], dtype=np.uint8)
+    for idx, img in enumerate(images):
+        if img is None:
+            continue
+        keys = pack_rgb(img[..., :3])
+        positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+        np.copyto(label_volume[idx], class_ids[positions], where=sorted_keys[positions] == keys)
+    return label_volume
+
+
+# step 1 straight from the mask files of a study, into a scratch_volume() (one mask in memory at a time)
+def load_label_volume(folder, prefix, organ_colors, directory=''):
+    paths = mask_files(folder, prefix)
+    first = next((img for img in map(load_mask, paths) if img is not None), None)
+    if first is None:
+        return None
+    label_volume = scratch_volume((len(paths),) + first.shape[:2], directory)
+    return build_label_volume(map(load_mask, paths), organ_colors, out=label_volume)
 
-    for volume in volumes:
-        threshold = np.max(volume) * 0.5
-        volume = volume[:, :, ::-1]  # Adjust coordinate system if necessary
-        verts, _, _, _ = measure.marching_cubes(volume, threshold)
-        total_verts_count += len(verts)
-        overall_center += np.sum(verts, axis=0)
 
-    overall_center /= total_verts_count  # Compute the average to get the center
+# 26-connectivity: fragments touching by a corner are one (marching cubes may join them)
+COMPONENT_STRUCTURE = np.ones((3, 3, 3), dtype=bool)
 
-    # extract mesh for each organ and translate them relative to the overall center
-    for i, volume in enumerate(volumes):
-        threshold = np.max(volume) * 0.5
-        volume = volume[:, :, ::-1]  # Adjust coordinate system if necessary
-        verts, faces, _, _ = measure.marching_cubes(volume, threshold)
 
-        # translate vertices relative to the overall center
-        verts -= overall_center
+# bounding box (slices) of the voxels of a class in a (slices, H, W) label volume, read in chunks of slices
+# (a scratch volume is never paged in whole), None when the class is absent
+def class_bounding_box(label_volume, class_id, chunk=64):
+    slices_any, rows_any, columns_any = [], 0, 0
+    for start in range(0, label_volume.shape[0], chunk):
+        mask = label_volume[start:start + chunk] == class_id
+        slices_any.append(mask.any(axis=(1, 2)))
+        rows_any = rows_any | mask.any(axis=(0, 2))
+        columns_any = columns_any | mask.any(axis=(0, 1))
+        del mask  # gone before the next chunk is compared
+    if not slices_any or not np.any(rows_any):
+        return None
+    box = []
+    for present in (np.concatenate(slices_any), rows_any, columns_any):
+        idx = np.flatnonzero(present)
+        box.append(slice(idx[0], idx[-1] + 1))
+    return tuple(box)
 
-        # append vertices, faces and color to their lists
+
+# pairs of (labels of) components touching across two consecutive slices, 26-connected: every voxel of `below`
+# meets the 3x3 voxels around it in `above`
+def _touching_labels(below, above):
+    height, width = below.shape
+    pairs = []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            lower = below[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)]
+            upper = above[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+            touching = (lower > 0) & (upper > 0)
+            pairs.append(np.column_stack([lower[touching], upper[touching]]))
+    return np.unique(np.concatenate(pairs), axis=0)
+
+
+# step 1b: drop the small fragments segmentation noise leaves around every organ, before they get closed and
+# meshed. every organ is labeled into connected components (within its bounding box); the components under
+# PRUNE_MIN_VOLUME mm3, or beyond the PRUNE_KEEP_LARGEST largest, are cleared from the label volume in place.
+# the largest component of an organ is always kept. returns per organ: (components, components removed, voxels
+# removed). the box is labeled `chunk` slices at a time, so the memory doesn't grow with the study: the
+# components of every chunk are numbered after those of the chunks before it, the ones touching across a chunk
+# boundary are merged, and the chunks holding removed components are labeled again to clear them.
+def prune_components(label_volume, num_organs, spacing, config=None, chunk=32):
+    config = config or MeshConfig()
+    voxel_volume = float(np.prod(spacing))
+    report = []
+    for class_id in range(1, num_organs + 1):
+        box = class_bounding_box(label_volume, class_id)
+        if box is None:
+            report.append((0, 0, 0))
+            continue
+        region = label_volume[box]
+        starts = range(0, region.shape[0], chunk)
+        chunk_sizes, links, offsets, last_slice = [np.zeros(1, dtype=np.int64)], [], [], None
+        num_labels = 1  # the background, then the components of every chunk one after another
+        for start in starts:
+            components, num_components = label(region[start:start + chunk] == class_id, COMPONENT_STRUCTURE)
+            offset = num_labels - 1
+            offsets.append(offset)
+            num_labels += num_components
+            chunk_sizes.append(np.bincount(components.reshape(-1), minlength=num_components + 1)[1:])
+            first_slice = np.where(components[0] > 0, components[0] + offset, 0)
+            if last_slice is not None:
+                links.append(_touching_labels(last_slice, first_slice))
+            last_slice = np.where(components[-1] > 0, components[-1] + offset, 0)
+            del components
+
+        # components of the whole box (0: the background), from the chunk components merged across boundaries
+        links = np.concatenate(links) if links else np.zeros((0, 2), dtype=np.int64)
+        graph = coo_matrix((np.ones(len(links)), (links[:, 0], links[:, 1])), shape=(num_labels, num_labels))
+        num_merged, merged = connected_components(graph, directed=False)
+        sizes = np.bincount(merged, weights=np.concatenate(chunk_sizes), minlength=num_merged).astype(np.int64)
+
+        keep = sizes * voxel_volume >= config.PRUNE_MIN_VOLUME
+        if config.PRUNE_KEEP_LARGEST:
+            keep[np.argsort(sizes[1:])[::-1][config.PRUNE_KEEP_LARGEST:] + 1] = False
+        keep[np.argmax(sizes[1:]) + 1] = True
+        keep[0] = True  # the other labels and the background stay as they are
+        removed = np.flatnonzero(~keep)
+        if len(removed):
+            keep_labels = keep[merged]
+            for start, offset, sizes_in_chunk in zip(starts, offsets, chunk_sizes[1:]):
+                chunk_keep = np.concatenate([[True], keep_labels[offset + 1:offset + 1 + len(sizes_in_chunk)]])
+                if chunk_keep.all():
+                    continue
+                components, _ = label(region[start:start + chunk] == class_id, COMPONENT_STRUCTURE)
+                region[start:start + chunk][~chunk_keep[components]] = 0  # a view: clears them in the label volume
+        report.append((num_merged - 1, len(removed), int(sizes[removed].sum())))
+    return report
+
+
+# (row, column, slice) voxel spacing in mm of a slice file, None when the name doesn't hold it
+def parse_spacing(file_name, slice_thickness=MeshConfig.SLICE_THICKNESS):
+    match = SPACING_PATTERN.search(os.path.basename(file_name))
+    if match is None:
+        return None
+    spacing_x, spacing_y = map(float, match.groups())
+    return spacing_y, spacing_x, slice_thickness
+
+
+# scale factors resampling a volume of the given spacing to isotropic voxels of its finest spacing
+# (1.5 x 1.5 x 3 mm gives the (1, 1, 2) zoom the meshes were always built with)
+def scale_factors(spacing):
+    spacing = np.asarray(spacing, dtype=np.float64)
+    return tuple(spacing / spacing.min())
+
+
+# region of an organ volume that holds the organ, with the geometry needed to resample it and to put its
+# mesh back where it would be in the full volume
+@dataclass
+class OrganROI:
+    volume: np.ndarray     # cropped (H, W, slices) mask
+    start: np.ndarray      # first (y, x, z) voxel of the crop in the full volume
+    out_start: np.ndarray  # first and last (excluded) resampled voxel of the crop in the full resampled volume
+    out_stop: np.ndarray
+    out_shape: np.ndarray  # shape of the full resampled volume
+    step: np.ndarray       # input voxels per resampled voxel along each axis, as used by zoom() on the full volume
+
+    # translation of the mesh vertices back to the full (z-flipped) volume
+    @property
+    def offset(self):
+        return np.array([self.out_start[0], self.out_start[1], self.out_shape[2] - self.out_stop[2]], dtype=np.float64)
+
+
+# crop an organ to its bounding box padded by `pad` (clipped to the volume), so the 3D steps only work on
+# the few percent of the field of view the organ occupies. an empty organ keeps the full volume.
+# `scale` is the zoom of every axis, or of z alone (in-plane kept) when a single number.
+# `volume` can also be the slices from `z_start` on of a larger volume of `shape`: it is then only cropped
+# in-plane, and the geometry is the one of the larger volume.
+def crop_volume(volume, scale, pad=ROI_PADDING, z_start=None, shape=None):
+    shape = np.array(volume.shape if shape is None else shape)
+    scale = np.array((1.0, 1.0, scale) if np.isscalar(scale) else scale, dtype=np.float64)
+    out_shape = np.round(shape * scale).astype(int)
+    step = np.ones(3)
+    np.divide(shape - 1, out_shape - 1, out=step, where=out_shape > 1)
+    coords = np.argwhere(volume)
+    if len(coords) == 0:
+        return OrganROI(volume, np.zeros(3, dtype=int), np.zeros(3, dtype=int), out_shape, out_shape, step)
+    lower = np.maximum(coords.min(axis=0) - pad, 0)
+    upper = np.minimum(coords.max(axis=0) + pad + 1, shape)
+    z_offset = 0
+    if z_start is not None:
+        lower[2], upper[2], z_offset = z_start, z_start + volume.shape[2], z_start
+    # resampled voxels whose sampling position falls inside the crop (up to the edge when not cropped there)
+    out_start = np.where(lower == 0, 0, np.ceil(lower / step)).astype(int)
+    out_stop = np.where(upper == shape, out_shape, np.floor((upper - 1) / step) + 1).astype(int)
+    crop = volume[lower[0]:upper[0], lower[1]:upper[1], lower[2] - z_offset:upper[2] - z_offset]
+    return OrganROI(crop, lower, out_start, out_stop, out_shape, step)
+
+
+# signed distance (mm) to the surface of a mask, negative inside
+def signed_distance(mask, spacing):
+    if not mask.any():
+        return np.ones(mask.shape, dtype=np.float32)
+    outside = distance_transform_edt(~mask, sampling=spacing)
+    inside = distance_transform_edt(mask, sampling=spacing)
+    return (outside - inside).astype(np.float32)
+
+
+# step 2 on a cropped organ, sampled at the positions zoom() samples the full volume at (the step of an
+# axis depends on the full size, not on the crop):
+# 'spline' resamples the mask itself (order 3 is the original cubic zoom of the booleans), while 'sdf' and
+# 'smooth' resample a continuous field (signed distance in mm, or blurred mask) and threshold it, which
+# gives smoother surfaces with a cheap linear interpolation
+def interpolate_roi(roi, method='spline', order=3, spacing=None, sigma=MeshConfig.SMOOTH_SIGMA):
+    output_shape = tuple(roi.out_stop - roi.out_start)
+    offset = roi.out_start * roi.step - roi.start
+    if method == 'spline':
+        return affine_transform(roi.volume, roi.step, offset=offset, output_shape=output_shape, order=order)
+    if method == 'sdf':
+        field = signed_distance(roi.volume, spacing if spacing is not None else (1.0, 1.0, 1.0))
+    elif method == 'smooth':
+        field = gaussian_filter(roi.volume.astype(np.float32), sigma)
+    else:
+        raise ValueError(f"Unknown resampling method '{method}'.")
+    resampled = affine_transform(field, roi.step, offset=offset, output_shape=output_shape, order=order,
+                                 mode='nearest')
+    return resampled < 0 if method == 'sdf' else resampled > 0.5
+
+
+
+# step 3 through two distance transforms, at a cost that doesn't grow with the radius: the same closing
+# as binary_closing() with a ball of `radius` (mm). the dilation keeps what lies within `radius` of the
+# mask, the erosion what lies further than `radius` from the outside. as in binary_closing(), the
+# dilation stops at the border of the volume, and whatever is beyond counts as outside for the erosion.
+def close_volume_edt(volume, radius, spacing=(1.0, 1.0, 1.0)):
+    if not volume.any():
+        return np.zeros_like(volume, dtype=bool)
+    radius += 1e-6  # a voxel exactly at `radius` belongs to the ball
+    padded = np.pad(volume.astype(bool, copy=False), 1)
+    dilated = distance_transform_edt(~padded, sampling=spacing) <= radius
+    inner = (slice(1, -1),) * 3
+    border = np.ones(dilated.shape, dtype=bool)
+    border[inner] = False
+    dilated[border] = False
+    return distance_transform_edt(dilated, sampling=spacing)[inner] > radius
+
+
+# voxels within `radius` (mm) of the mask: the squared distance to the mask is a sum of one term per
+# axis, so it is minimized one axis at a time, over the few offsets that can stay within the radius
+def _near(mask, radius, spacing):
+    dist = np.where(mask, np.float32(0), np.float32(np.inf))
+    for axis, voxel in enumerate(spacing):
+        out = dist.copy()
+        for d in range(1, int(radius // voxel) + 1):
+            weight = np.float32((d * voxel) ** 2)
+            head = (slice(None),) * axis + (slice(d, None),)
+            tail = (slice(None),) * axis + (slice(None, -d),)
+            np.minimum(out[head], dist[tail] + weight, out=out[head])
+            np.minimum(out[tail], dist[head] + weight, out=out[tail])
+        dist = out
+    return dist <= np.float32(radius ** 2 + 1e-6)
+
+
+# step 3 as a separable closing: the same closing as binary_closing() with a ball of `radius` (mm), at a
+# few vectorized passes per axis instead of one pass per voxel of the ball. everything beyond the border
+# counts as outside for the erosion, as in binary_closing().
+def close_volume_separable(volume, radius, spacing=(1.0, 1.0, 1.0)):
+    dilated = _near(volume, radius, spacing)
+    pad = [int(radius // voxel) for voxel in spacing]
+    outside = np.pad(~dilated, [(p, p) for p in pad], constant_values=True)
+    closed = ~_near(outside, radius, spacing)
+    return closed[tuple(slice(p, p + n) for p, n in zip(pad, volume.shape))]
+
+
+# step 3 with the configured method, on a volume of isotropic `voxel_size` (mm) voxels
+def close_volume(volume, voxel_size, config=None):
+    config = config or MeshConfig()
+    if config.CLOSING_METHOD == 'ball':
+        return binary_closing(volume, structure=ball(int(round(config.CLOSING_RADIUS / voxel_size))))
+    if config.CLOSING_METHOD == 'separable':
+        return close_volume_separable(volume, config.CLOSING_RADIUS, (voxel_size,) * 3)
+    if config.CLOSING_METHOD == 'edt':
+        return close_volume_edt(volume, config.CLOSING_RADIUS, (voxel_size,) * 3)
+    raise ValueError(f"Unknown closing method '{config.CLOSING_METHOD}'.")
+
+
+# step 4: extract mesh from a 3D volume, moved by its roi offset to where the full (z-flipped) volume puts it
+def mesh_volume(volume, offset=(0.0, 0.0, 0.0)):
+    threshold = np.max(volume) * 0.5
+    volume = volume[:, :, ::-1]  # Adjust coordinate system if necessary
+    verts, faces, _, _ = measure.marching_cubes(volume, threshold)
+    verts += np.asarray(offset, dtype=verts.dtype)
+    return verts, faces
+
+
+# translate the organ meshes relative to the overall center of all organs combined, and color them
+def center_meshes(meshes, colors=MESH_COLORS):
+    overall_center = np.zeros(3, dtype=np.float64)
+    for verts, _ in meshes:
+        overall_center += np.sum(verts, axis=0)
+    num_vertices = sum(len(verts) for verts, _ in meshes)
+    if num_vertices:
+        overall_center /= num_vertices  # Compute the average to get the center
+
+    vertices_list, faces_list, colors_list = [], [], []
+    for i, (verts, faces) in enumerate(meshes):
+        verts -= overall_center  # in place, the vertices stay float32
         vertices_list.append(verts)
         faces_list.append(faces)
         colors_list.append([colors[i]] * len(verts))  # Assign color to vertices of the organ
-        color_index += 1 # iterate over color index
-        
     return vertices_list, faces_list, colors_list
 
 
-# determine if generated mesh is valid (inside of step 5)
+# step 2 for one organ of a (slices, H, W) label volume with the given voxel spacing: crop and resample it
+def resample_organ(label_volume, class_id, spacing, config=None):
+    config = config or MeshConfig()
+    roi = crop_volume((label_volume == class_id).transpose(1, 2, 0), scale_factors(spacing))
+    volume = interpolate_roi(roi, config.RESAMPLE_METHOD, config.RESAMPLE_ORDER, spacing, config.SMOOTH_SIGMA)
+    return roi, volume
+
+
+# steps 2 to 4 for one organ: crop, resample, close and mesh it
+def mesh_organ(label_volume, class_id, spacing, config=None):
+    config = config or MeshConfig()
+    with memory_stage('resample'):
+        roi, volume = resample_organ(label_volume, class_id, spacing, config)
+    with memory_stage('close'):
+        volume = close_volume(volume, min(spacing), config)
+    with memory_stage('marching cubes'):
+        return mesh_volume(volume, roi.offset)
+
+
+# format of the cached slab meshes, to bump whenever the meshing changes what a slab gives
+SLAB_FORMAT = 1
+
+# input slices read beyond the ones a slab samples: the signed distance is exact within a voxel of a sign
+# change, and the 'smooth' blur reaches two slices
+SLAB_INPUT_HALO = 3
+
+EMPTY_MESH = (np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.int32))
+
+
+# a z-slab of the resampled volume: the marching cubes cells between resampled slices `start` and
+# `stop` - 1, and the input slices [input_start, input_stop) it is resampled and closed from
+@dataclass(frozen=True)
+class Slab:
+    start: int
+    stop: int
+    input_start: int
+    input_stop: int
+
+
+# split the resampled z axis of a study of `num_slices` slices into slabs of SLAB_SIZE cells, aligned on
+# multiples of SLAB_SIZE so an edit of a few slices leaves the other slabs (and their cache keys) as they
+# were. neighbouring slabs share their boundary slice. each slab reads the input slices the resampling and
+# the closing of its cells reach (twice the closing radius, plus one), so it meshes exactly like the whole
+# volume would for the 'sdf' and 'smooth' methods (the cubic 'spline' prefilter reaches a little further).
+def slab_ranges(num_slices, spacing, config=None):
+    config = config or MeshConfig()
+    out_size = int(np.round(num_slices * scale_factors(spacing)[2]))
+    step = (num_slices - 1) / (out_size - 1) if out_size > 1 else 1.0
+    halo = 2 * int(np.ceil(config.CLOSING_RADIUS / min(spacing))) + 1
+    slabs = []
+    for start in range(0, max(out_size - 1, 1), config.SLAB_SIZE):
+        stop = min(start + config.SLAB_SIZE + 1, out_size)
+        input_start = int(np.floor(max(start - halo, 0) * step)) - SLAB_INPUT_HALO
+        input_stop = int(np.ceil((min(stop + halo, out_size) - 1) * step)) + 1 + SLAB_INPUT_HALO
+        slabs.append(Slab(start, stop, max(input_start, 0), min(input_stop, num_slices)))
+    return slabs
+
+
+# cache key of the mesh of an organ slab: its labels and every setting the mesh depends on
+def slab_key(label_volume, class_id, slab, spacing, config):
+    mask = label_volume[slab.input_start:slab.input_stop] == class_id
+    if not mask.any():
+        return None
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(np.packbits(mask).tobytes())
+    digest.update(repr((SLAB_FORMAT, label_volume.shape, slab, tuple(map(float, spacing)), config.RESAMPLE_METHOD,
+                        config.RESAMPLE_ORDER, config.SMOOTH_SIGMA, config.CLOSING_RADIUS,
+                        config.CLOSING_METHOD)).encode())
+    return digest.hexdigest()
+
+
+# steps 2 to 4 for one z-slab of an organ: crop, resample and close the slices around it, then mesh its
+# cells only, placed where the mesh of the whole organ would put them
+def mesh_slab(label_volume, class_id, slab, spacing, config=None):
+    config = config or MeshConfig()
+    with memory_stage('resample'):
+        mask = (label_volume[slab.input_start:slab.input_stop] == class_id).transpose(1, 2, 0)
+        if not mask.any():
+            return EMPTY_MESH
+        shape = (label_volume.shape[1], label_volume.shape[2], label_volume.shape[0])
+        roi = crop_volume(mask, scale_factors(spacing), z_start=slab.input_start, shape=shape)
+        volume = interpolate_roi(roi, config.RESAMPLE_METHOD, config.RESAMPLE_ORDER, spacing, config.SMOOTH_SIGMA)
+    with memory_stage('close'):
+        volume = close_volume(volume, min(spacing), config)
+    cells = volume[:, :, slab.start - roi.out_start[2]:slab.stop - roi.out_start[2]]
+    if not cells.any():
+        return EMPTY_MESH
+    offset = [roi.out_start[0], roi.out_start[1], roi.out_shape[2] - slab.stop]
+    with memory_stage('marching cubes'):
+        return mesh_volume(cells, offset)
+
+
+# stitch the meshes of consecutive slabs into one: the vertices on the slices two slabs share come out
+# the same from both, so they are welded into one (at z = `seams`, in mesh coordinates)
+def stitch_slabs(meshes, seams):
+    meshes = [mesh for mesh in meshes if len(mesh[1])]
+    if not meshes:
+        return EMPTY_MESH
+    offsets = np.cumsum([0] + [len(verts) for verts, _ in meshes[:-1]])
+    verts = np.concatenate([verts for verts, _ in meshes]).astype(np.float32, copy=False)
+    faces = np.concatenate([faces + offset for (_, faces), offset in zip(meshes, offsets)])
+    on_seam = np.flatnonzero(np.isin(verts[:, 2], np.asarray(seams, dtype=np.float32)))
+    if len(on_seam) == 0:
+        return verts, faces
+    _, first, inverse = np.unique(verts[on_seam], axis=0, return_index=True, return_inverse=True)
+    target = np.arange(len(verts))
+    target[on_seam] = on_seam[first][inverse.reshape(-1)]
+    keep = np.ones(len(verts), dtype=bool)
+    keep[on_seam] = False
+    keep[on_seam[first]] = True
+    new_index = np.cumsum(keep) - 1
+    return verts[keep], new_index[target][faces].astype(np.int32)
+
+
+# the mesh threads are started once and reused. threads and not processes: marching cubes and the ndimage
+# filters release the GIL, and the workers read the label volume (or its scratch file) as it is.
+_mesh_pool = None
+_mesh_pool_lock = threading.Lock()
+
+
+def get_mesh_pool(workers):
+    global _mesh_pool
+    with _mesh_pool_lock:
+        if _mesh_pool is None:
+            _mesh_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='mesh')
+        return _mesh_pool
+
+
+# fn(label_volume, *args) for every args of `tasks`, in parallel on the mesh threads
+def map_shared(fn, label_volume, tasks, workers):
+    if workers <= 1 or len(tasks) <= 1:
+        return [fn(label_volume, *args) for args in tasks]
+    pool = get_mesh_pool(workers)
+    futures = [pool.submit(fn, label_volume, *args) for args in tasks]
+    return [future.result() for future in futures]
+
+
+# the slab mesh cache is opened on first use, once per worker
+_mesh_cache = None
+_mesh_cache_lock = threading.Lock()
+
+
+def get_mesh_cache():
+    global _mesh_cache
+    with _mesh_cache_lock:
+        if _mesh_cache is None:
+            _mesh_cache = MeshCache(CacheConfig.MESH_PATH, CacheConfig.MESH_MAX_BYTES)
+        return _mesh_cache
+
+
+# steps 2 to 4 for every organ, in parallel. by default every organ is meshed in z-slabs, all slabs of all
+# organs side by side; with a cache, only the slabs whose labels changed since they were cached are meshed
+# again. with SLAB_SIZE = 0 each worker builds, crops, zooms, closes and meshes a whole organ.
+def mesh_organs(label_volume, num_organs, spacing, config=None, workers=None, cache=None):
+    config = config or MeshConfig()
+    workers = MESH_WORKERS if workers is None else workers
+    class_ids = range(1, num_organs + 1)
+    if not config.SLAB_SIZE:
+        return map_shared(mesh_organ, label_volume, [(class_id, spacing, config) for class_id in class_ids], workers)
+
+    slabs = slab_ranges(label_volume.shape[0], spacing, config)
+    tasks = [(class_id, slab) for class_id in class_ids for slab in slabs]
+    with memory_stage('slab keys'):
+        keys = [slab_key(label_volume, class_id, slab, spacing, config) for class_id, slab in tasks]
+    found = cache.get_many(key for key in keys if key is not None) if cache is not None else {}
+    missing = [idx for idx, key in enumerate(keys) if key is not None and key not in found]
+    computed = map_shared(mesh_slab, label_volume, [tasks[idx] + (spacing, config) for idx in missing], workers)
+    if cache is not None:
+        cache.put_many((keys[idx], *mesh) for idx, mesh in zip(missing, computed))
+    found.update((keys[idx], mesh) for idx, mesh in zip(missing, computed))
+    if missing and len(missing) < sum(key is not None for key in keys):
+        print(f"Meshed {len(missing)} of {sum(key is not None for key in keys)} organ slabs, the others were cached.")
+
+    # the slices shared by two slabs, as z coordinates of the (z-flipped) meshes
+    out_size = slabs[-1].stop
+    seams = [out_size - slab.stop for slab in slabs[:-1]]
+    meshes = []
+    with memory_stage('stitch'):
+        for class_id in class_ids:
+            slab_meshes = [found.get(key, EMPTY_MESH) for (task_class, _), key in zip(tasks, keys)
+                           if task_class == class_id]
+            meshes.append(stitch_slabs(slab_meshes, seams))
+    return meshes
+
+
+# determine if generated mesh is valid (inside of step 5): triangles only, every index within the vertices
 def is_valid_mesh(vertices, faces):
+    faces = np.asarray(faces)
     if len(vertices) == 0 or len(faces) == 0:
         return False
-    for face in faces:
-        if len(face) != 3:
-            return False
-        for idx in face:
-            if idx < 0 or idx >= len(vertices):
-                return False
-    return True
-
-# step 5: save to .obj and .mtl files
-def save_as_obj_with_mtl(filename, organ_vertices_list, organ_faces_list, organ_colors_list):
+    if faces.ndim != 2 or faces.shape[1] != 3:
+        return False
+    return bool(faces.min() >= 0 and faces.max() < len(vertices))
+
+
+# text of every number below 10000 as 4 characters: zero-padded, blank-padded, and all blanks (last row)
+DIGIT_GROUPS = np.array([list(f'{i:04d}'.encode()) for i in range(10000)]
+                        + [list(f'{i:4d}'.encode()) for i in range(10000)] + [list(b'    ')], dtype=np.uint8)
+DIGIT_WORDS = DIGIT_GROUPS.view(np.uint32)[:, 0]
+
+
+# right-aligned text of non-negative integers written into the last `out.shape[-1]` characters of `out`,
+# 4 digits per table lookup. `blank` leaves leading zeros blank (the units digit is always written).
+def _digits(values, out, blank=True):
+    num_digits = out.shape[-1]
+    rest = values
+    for group in range((num_digits + 3) // 4):
+        rest, index = np.divmod(rest, 10000)
+        if blank:
+            # blank-padded group when it holds the leading digit, all blanks when it's entirely above it
+            index[rest == 0] += 10000
+            if group:
+                index[values < 10000 ** group] = 20000
+        stop = num_digits - 4 * group
+        width = min(4, stop)
+        # one 4-byte word per group: a flat take is much faster than indexing rows of the table
+        text = DIGIT_WORDS.take(index).view(np.uint8).reshape(index.shape + (4,))
+        out[..., stop - width:stop] = text[..., 4 - width:]
+
+
+# rows of numbers as fixed-width, right-aligned text (one uint8 character array per cell), formatted with
+# array operations only: integer and decimal digits come from table lookups, and the minus sign goes right
+# before the leading digit. every cell reads like f'{x:.{decimals}f}' (and -0.0 keeps its sign, as there).
+def format_columns(values, decimals=0):
+    # scaled in float64, where a float32 times 10 ** decimals is exact, so it rounds like the f-string. a product
+    # landing exactly on .5 can still be a rounded near-tie of a float64: those few are rounded by Python.
+    scaled = np.abs(values).astype(np.float64) * 10 ** decimals
+    ties = np.flatnonzero(scaled % 1 == 0.5)
+    scaled = np.rint(scaled)
+    for idx in ties:
+        scaled.flat[idx] = int(f'{abs(float(values.flat[idx])):.{decimals}f}'.replace('.', ''))
+    # 32-bit integer math is noticeably faster, and mesh coordinates stay far below its range
+    dtype = np.uint32 if scaled.size == 0 or scaled.max() < 2 ** 32 else np.uint64
+    scaled = scaled.astype(dtype)
+    integer, fraction = np.divmod(scaled, dtype(10 ** decimals))
+    int_digits = len(str(int(integer.max()))) if integer.size else 1
+    # separator, sign, integer part, then decimal point and decimals
+    chars = np.empty(values.shape + (2 + int_digits + (1 + decimals if decimals else 0),), dtype=np.uint8)
+    chars[..., :2] = ord(' ')
+    _digits(integer, chars[..., 2:2 + int_digits])
+    if decimals:
+        chars[..., 2 + int_digits] = ord('.')
+        _digits(fraction, chars[..., 3 + int_digits:], blank=False)
+
+    negative = np.signbit(values)
+    if negative.any():
+        # the leading digit is in column 2 + int_digits - (number of integer digits)
+        num_digits = np.ones(values.shape, dtype=np.int64)
+        for power in range(1, int_digits):
+            num_digits += integer >= 10 ** power
+        np.put_along_axis(chars, (1 + int_digits - num_digits)[..., None],
+                          np.where(negative, ord('-'), ord(' ')).astype(np.uint8)[..., None], axis=-1)
+    return chars
+
+
+# '<keyword> <a> <b> <c>' lines for every row of a (n, 3) array, as bytes (the number columns are padded
+# to a common width, which obj readers don't mind)
+def format_lines(keyword, rows, decimals=0, chunk_size=1 << 18):
+    blocks = []
+    for start in range(0, len(rows), chunk_size):
+        chars = format_columns(rows[start:start + chunk_size], decimals).reshape(len(rows[start:start + chunk_size]), -1)
+        prefix = np.frombuffer(keyword.encode(), dtype=np.uint8)
+        line = np.empty((len(chars), len(prefix) + chars.shape[1] + 1), dtype=np.uint8)
+        line[:, :len(prefix)] = prefix
+        line[:, len(prefix):-1] = chars
+        line[:, -1] = ord('\n')
+        blocks.append(line.tobytes())
+    return b''.join(blocks)
+
+
+# the (slices, H, W) label volume of threed_render's input (a label volume, or rgb masks): with OUT_OF_CORE
+# in a scratch file, unless it already is a memory-mapped volume (and isn't going to be pruned). an `owned`
+# label volume belongs to the rendering and is always used as is.
+def to_label_volume(images, organ_colors, config, owned=False):
+    is_label_volume = isinstance(images, np.ndarray) and images.ndim == 3
+    # the pruning edits the label volume, so it never works on the caller's
+    pruned = config.PRUNE_MIN_VOLUME > 0 or config.PRUNE_KEEP_LARGEST > 0
+    if is_label_volume and (owned or not pruned and (isinstance(images, np.memmap) or not config.OUT_OF_CORE)):
+        return images
+    if not config.OUT_OF_CORE:
+        return images.copy() if is_label_volume else build_label_volume(images, organ_colors)
+    if is_label_volume:
+        label_volume = scratch_volume(images.shape, config.SCRATCH_DIR)
+        label_volume[...] = images
+        return label_volume
+    label_volume = scratch_volume((len(images),) + images[0].shape[:2], config.SCRATCH_DIR)
+    return build_label_volume(images, organ_colors, out=label_volume)
+
+
+# the gzipped copy of an .obj (its blocks), through a temporary file so a server never sees half of one
+def write_gzip_copy(obj_filename, blocks, level):
+    fd, tmp_path = tempfile.mkstemp(suffix='.gz.tmp', dir=os.path.dirname(obj_filename) or None)
+    try:
+        with os.fdopen(fd, 'wb') as raw, gzip.GzipFile(os.path.basename(obj_filename), 'wb', level, raw) as f:
+            f.writelines(blocks)
+        os.replace(tmp_path, obj_filename + '.gz')
+    except OSError:
+        print(f"Failed to write {os.path.basename(obj_filename)}.gz.")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# step 5: save to .obj and .mtl files (+ a gzipped copy of the .obj for compressed serving). the vertex and
+# face blocks of every organ are formatted in bulk. the gzipped copy is written in the background, on the frame
+# writer threads: returns its future (None without one).
+def save_as_obj_with_mtl(filename, organ_vertices_list, organ_faces_list, organ_colors_list,
+                         decimals=MeshConfig.OBJ_DECIMALS, gzip_level=MeshConfig.OBJ_GZIP_LEVEL):
     # retrieve base-filename and append extension
     obj_filename = filename
     mtl_filename = filename[:-4] + '.mtl'
 
-    # write .obj file
-    with open(obj_filename, 'w') as f:
-        vertex_offset = 1  # Start indexing vertices from 1
-        for organ_idx, (vertices, faces) in enumerate(zip(organ_vertices_list, organ_faces_list), start=1):
-            if not is_valid_mesh(vertices, faces):
-                print(f"Invalid mesh data for Organ{organ_idx}. Skipping save.")
-                continue
-            f.write(f'g Organ{organ_idx}\n')
-            for v in vertices:
-                f.write(f'v {v[0]} {v[2]} {v[1]}\n')  # Swap y and z coordinates
-            f.write(f'mtllib {os.path.basename(mtl_filename)}\n')
-            f.write(f'usemtl Organ{organ_idx}\n')
-            adjusted_faces = [[idx + vertex_offset for idx in face[::-1]] for face in faces]  # Swap indices for y and z
-            for face in adjusted_faces:
-                if len(face) != 3:
-                    print(f"Skipping invalid face with {len(face)} vertices.")
-                    continue
-                f.write(f'f {" ".join(map(str, face))}\n')
-            vertex_offset += len(vertices)
-            
-    # write .mtl file
+    # .obj content, organ by organ
+    blocks = []
+    vertex_offset = 1  # Start indexing vertices from 1
+    for organ_idx, (vertices, faces) in enumerate(zip(organ_vertices_list, organ_faces_list), start=1):
+        if not is_valid_mesh(vertices, faces):
+            print(f"Invalid mesh data for Organ{organ_idx}. Skipping save.")
+            continue
+        vertices, faces = np.asarray(vertices), np.asarray(faces)
+        blocks.append(f'g Organ{organ_idx}\n'.encode())
+        blocks.append(format_lines('v', vertices[:, [0, 2, 1]], decimals))  # Swap y and z coordinates
+        blocks.append(f'mtllib {os.path.basename(mtl_filename)}\n'.encode())
+        blocks.append(f'usemtl Organ{organ_idx}\n'.encode())
+        blocks.append(format_lines('f', faces[:, ::-1].astype(np.int64) + vertex_offset))  # Swap indices for y and z
+        vertex_offset += len(vertices)
+
+    # write .obj file (an older compressed copy goes first, it would stand for another mesh until replaced)
+    if os.path.exists(obj_filename + '.gz'):
+        os.remove(obj_filename + '.gz')
+    with open(obj_filename, 'wb') as f:
+        f.writelines(blocks)
+    gzip_copy = get_executor().submit(write_gzip_copy, obj_filename, blocks, gzip_level) if gzip_level else None
+
+    # write .mtl file (colors by organ: an empty organ has no vertex colors)
     with open(mtl_filename, 'w') as f:
-        for organ_idx, colors in enumerate(organ_colors_list, start=1):
+        for organ_idx in range(1, len(organ_colors_list) + 1):
+            color = MESH_COLORS[organ_idx - 1]
             f.write(f'newmtl Organ{organ_idx}\n')
-            f.write(f'Ka {colors[0][0]} {colors[0][1]} {colors[0][2]}\n')  # Ambient color
-            f.write(f'Kd {colors[1][0]} {colors[1][1]} {colors[1][2]}\n')  # Diffuse color
-            f.write(f'Ks {colors[2][0]} {colors[2][1]} {colors[2][2]}\n')  # Specular color
+            f.write(f'Ka {color[0]} {color[1]} {color[2]}\n')  # Ambient color
+            f.write(f'Kd {color[0]} {color[1]} {color[2]}\n')  # Diffuse color
+            f.write(f'Ks {color[0]} {color[1]} {color[2]}\n')  # Specular color
             f.write(f'Ns 200\n')  # Higher specular exponent for increased reflectivity
             f.write(f'illum 2\n')  # Illumination model
             f.write(f'Ni 1.0\n')  # Optical density (index of refraction)
             f.write(f'd 1.0\n')    # Dissolve factor (opacity)
+    return gzip_copy
         
 
-# finally: call above functions in correct order
-def threed_render(images, combined_filename, organ_colors):
+# glTF constants
+GLB_MAGIC, GLB_VERSION, GLB_JSON, GLB_BIN = 0x46546C67, 2, 0x4E4F534A, 0x004E4942
+ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER = 34962, 34963
+COMPONENT_TYPES = {np.dtype(np.int8): 5120, np.dtype(np.uint16): 5123, np.dtype(np.uint32): 5125,
+                   np.dtype(np.float32): 5126}
+
+
+# area-weighted vertex normals of a triangle mesh, following the winding of the faces
+def vertex_normals(vertices, faces):
+    corners = vertices[faces]
+    face_normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    normals = np.zeros_like(vertices)
+    for corner in range(3):
+        np.add.at(normals, faces[:, corner], face_normals)
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    return normals / np.where(lengths > 0, lengths, 1)
+
+
+# srgb color (as in the .mtl) to the linear base color glTF expects
+def srgb_to_linear(color):
+    color = np.asarray(color, dtype=np.float64)
+    return np.where(color <= 0.04045, color / 12.92, ((color + 0.055) / 1.055) ** 2.4)
+
+
+# binary buffer and json description (buffer views, accessors) of the glTF file being built
+class GLBBuffer:
+    def __init__(self):
+        self.chunks = []
+        self.length = 0
+        self.buffer_views = []
+        self.accessors = []
+
+    # add a (count, components) or flat array as a buffer view + accessor, returns the accessor index
+    def add(self, array, accessor_type, target, normalized=False, bounds=False):
+        array = np.ascontiguousarray(array)
+        self.buffer_views.append({'buffer': 0, 'byteOffset': self.length, 'byteLength': array.nbytes,
+                                  'target': target})
+        accessor = {'bufferView': len(self.buffer_views) - 1, 'componentType': COMPONENT_TYPES[array.dtype],
+                    'count': len(array), 'type': accessor_type}
+        if normalized:
+            accessor['normalized'] = True
+        if bounds:
+            accessor['min'] = array.min(axis=0).tolist()
+            accessor['max'] = array.max(axis=0).tolist()
+        self.accessors.append(accessor)
+        padding = -array.nbytes % 4  # every view starts on a 4-byte boundary
+        self.chunks.append(array.tobytes() + b'\x00' * padding)
+        self.length += array.nbytes + padding
+        return len(self.accessors) - 1
+
+
+# step 5 (binary): save every organ as one mesh + material of a binary glTF file, with typed vertex, normal
+# and index buffers. with `quantize`, positions are stored as 16-bit integers (mapped back by the node
+# transform) and normals as 8-bit integers, following KHR_mesh_quantization.
+def save_as_glb(filename, organ_vertices_list, organ_faces_list, organ_colors_list, quantize=True):
+    buffer = GLBBuffer()
+    nodes, meshes, materials = [], [], []
+    for organ_idx, (vertices, faces) in enumerate(zip(organ_vertices_list, organ_faces_list), start=1):
+        vertices, faces = np.asarray(vertices), np.asarray(faces)
+        if not is_valid_mesh(vertices, faces):
+            print(f"Invalid mesh data for Organ{organ_idx}. Skipping save.")
+            continue
+        # same axes and winding as the .obj: y and z swapped, faces reversed
+        positions = vertices[:, [0, 2, 1]].astype(np.float32)
+        indices = faces[:, ::-1].astype(np.uint32)
+        normals = vertex_normals(positions, indices).astype(np.float32)
+
+        node = {'name': f'Organ{organ_idx}', 'mesh': len(meshes)}
+        if quantize:
+            # one scale for all axes: a non-uniform node scale would skew the (world space) normals
+            lower, upper = positions.min(axis=0), positions.max(axis=0)
+            scale = max(float(np.max(upper - lower)), 1e-6) / 65535.0
+            positions = np.round((positions - lower) / scale).astype(np.uint16)
+            normals = np.round(normals * 127.0).astype(np.int8)
+            node.update(translation=lower.tolist(), scale=[scale] * 3)
+        attributes = {
+            'POSITION': buffer.add(positions, 'VEC3', ARRAY_BUFFER, bounds=True),
+            'NORMAL': buffer.add(normals, 'VEC3', ARRAY_BUFFER, normalized=quantize),
+        }
+        primitive = {'attributes': attributes, 'indices': buffer.add(indices.reshape(-1), 'SCALAR', ELEMENT_ARRAY_BUFFER),
+                     'material': len(materials), 'mode': 4}
+        meshes.append({'name': f'Organ{organ_idx}', 'primitives': [primitive]})
+        base_color = srgb_to_linear(MESH_COLORS[organ_idx - 1]).tolist() + [1.0]
+        materials.append({'name': f'Organ{organ_idx}', 'pbrMetallicRoughness': {
+            'baseColorFactor': base_color, 'metallicFactor': 0.0, 'roughnessFactor': 0.5}})
+        nodes.append(node)
+
+    gltf = {'asset': {'version': '2.0', 'generator': 'dats-data threed.py'}, 'scene': 0,
+            'scenes': [{'nodes': list(range(len(nodes)))}], 'nodes': nodes, 'meshes': meshes, 'materials': materials,
+            'accessors': buffer.accessors, 'bufferViews': buffer.buffer_views, 'buffers': [{'byteLength': buffer.length}]}
+    if quantize:
+        gltf['extensionsUsed'] = gltf['extensionsRequired'] = ['KHR_mesh_quantization']
+
+    json_chunk = json.dumps(gltf, separators=(',', ':')).encode()
+    json_chunk += b' ' * (-len(json_chunk) % 4)
+    bin_chunk = b''.join(buffer.chunks)
+    total = 12 + 8 + len(json_chunk) + 8 + len(bin_chunk)
+    with open(filename, 'wb') as f:
+        f.write(struct.pack('<III', GLB_MAGIC, GLB_VERSION, total))
+        f.write(struct.pack('<II', len(json_chunk), GLB_JSON))
+        f.write(json_chunk)
+        f.write(struct.pack('<II', len(bin_chunk), GLB_BIN))
+        f.write(bin_chunk)
+
+
+# levels of detail next to the full mesh: one .glb per triangle budget of LOD_TRIANGLES (<name>.lod1.glb the
+# finest), and <name>.lods.json listing every level from the coarsest to the full <name>.glb, for the render page
+# to load the coarse ones first. with LOD_OBJ the coarsest level is also saved as .obj/.mtl (its 'obj' entry).
+def save_lods(filename, organ_vertices_list, organ_faces_list, organ_colors_list, config=None):
+    config = config or MeshConfig()
+    base = os.path.splitext(filename)[0]
+    organ_levels = [mesh_lods(vertices, faces, config.LOD_TRIANGLES, config.LOD_SMOOTHING)
+                    for vertices, faces in zip(organ_vertices_list, organ_faces_list)]
+    levels = [{'file': os.path.basename(base) + '.glb', 'triangles': int(sum(len(faces) for faces in organ_faces_list))}]
+    for level, meshes in enumerate(zip(*organ_levels), start=1):
+        level_filename = f'{base}.lod{level}.glb'
+        save_as_glb(level_filename, [vertices for vertices, _ in meshes], [faces for _, faces in meshes],
+                    organ_colors_list, config.GLB_QUANTIZE)
+        levels.insert(0, {'file': os.path.basename(level_filename),
+                          'triangles': int(sum(len(faces) for _, faces in meshes))})
+    if config.LOD_OBJ and len(levels) > 1:
+        coarsest = [level_meshes[-1] for level_meshes in organ_levels]
+        obj_filename = f'{base}.lod{len(levels) - 1}.obj'
+        save_as_obj_with_mtl(obj_filename, [vertices for vertices, _ in coarsest], [faces for _, faces in coarsest],
+                             organ_colors_list, config.OBJ_DECIMALS, config.OBJ_GZIP_LEVEL)
+        levels[0]['obj'] = os.path.basename(obj_filename)
+    with open(base + '.lods.json', 'w') as f:
+        json.dump({'levels': levels}, f)
+
+
+# finally: call above functions in correct order.
+# `images` is either the list of rgb masks loaded from disk or the label volume returned by predict(),
+# `spacing` its (row, column, slice) voxel spacing in mm (see parse_spacing). with `owned`, the label volume
+# is handed over to the rendering: pruned in place, and its scratch file (if any) deleted once meshed.
+def threed_render(images, combined_filename, organ_colors, spacing=None, config=None, owned=False):
+    config = config or MeshConfig()
+    spacing = spacing or (config.PIXEL_SPACING, config.PIXEL_SPACING, config.SLICE_THICKNESS)
     # Check if images exist
-    if images:
-        organ_volumes = extract_organ_masks(images, organ_colors)
-        organ_volumes = interpolate_volumes(organ_volumes, scale_factor=2)
-        organ_volumes = close_volumes(organ_volumes, size=2)
-        
-        vertices_list, faces_list, colors_list = extract_mesh_from_volumes(organ_volumes)
-        save_as_obj_with_mtl(combined_filename, vertices_list, faces_list, colors_list)
-        print(f"All organs saved as {combined_filename}")
-    else:
+    if not len(images):
         print("No images to process.")
-        
-        
\ No newline at end of file
+        return
+    report = MemoryReport() if config.MEMORY_REPORT and _memory_report is None else nullcontext()
+    with report:
+        with memory_stage('label volume'):
+            label_volume = to_label_volume(images, organ_colors, config, owned)
+        scratch_path = _scratch_path(label_volume) if owned or label_volume is not images else None
+        try:
+            pruned = []
+            if config.PRUNE_MIN_VOLUME > 0 or config.PRUNE_KEEP_LARGEST > 0:
+                with memory_stage('prune'):
+                    pruned = prune_components(label_volume, len(organ_colors), spacing, config)
+            # every 3D step only runs on the bounding box of each organ, in z-slabs meshed in parallel, and the
+            # slabs that didn't change since the last rendering come from the cache
+            cache = get_mesh_cache() if config.SLAB_CACHE and CacheConfig.ENABLED else None
+            workers = 1 if _memory_report is not None else None  # so the report sees every step
+            meshes = mesh_organs(label_volume, len(organ_colors), spacing, config, workers, cache)
+            # the triangles the pruning saved would take a second, unpruned build: `bench.py prune` measures them,
+            # a rendering only logs what is left
+            for organ_idx, (num_components, num_removed, voxels) in enumerate(pruned, start=1):
+                if num_removed:
+                    print(f"Organ{organ_idx}: removed {num_removed} of {num_components} fragments "
+                          f"({voxels} voxels, {voxels * float(np.prod(spacing)):.0f} mm3), "
+                          f"{len(meshes[organ_idx - 1][1])} triangles left.")
+        finally:
+            if scratch_path is not None:
+                del label_volume  # unmapped before the file goes
+                os.remove(scratch_path)
+
+        with memory_stage('save'):
+            vertices_list, faces_list, colors_list = center_meshes(meshes)
+            save_as_obj_with_mtl(combined_filename, vertices_list, faces_list, colors_list, config.OBJ_DECIMALS,
+                                 config.OBJ_GZIP_LEVEL)
+            # the render page loads the binary glTF next to it when it can
+            save_as_glb(os.path.splitext(combined_filename)[0] + '.glb', vertices_list, faces_list, colors_list,
+                        config.GLB_QUANTIZE)
+        if config.LOD_TRIANGLES:
+            with memory_stage('levels of detail'):
+                save_lods(combined_filename, vertices_list, faces_list, colors_list, config)
+    if isinstance(report, MemoryReport):
+        report.print()
+    print(f"All organs saved as {combined_filename}")
+
+
+# tier 1 of a progressive rendering: a preview of every organ meshed straight from the label volume, subsampled
+# in-plane by PREVIEW_STEP (no resampling, closing or pruning), scaled and flipped like the full meshes so one
+# replaces the other in place. saved as <name>.preview.glb and .preview.obj/.mtl.
+def preview_render(label_volume, combined_filename, organ_colors, spacing=None, config=None):
+    config = config or MeshConfig()
+    spacing = spacing or (config.PIXEL_SPACING, config.PIXEL_SPACING, config.SLICE_THICKNESS)
+    step = config.PREVIEW_STEP
+    subsampled = label_volume[:, ::step, ::step]
+    scale = np.array(scale_factors(spacing)) * (step, step, 1)
+    meshes = []
+    for class_id in range(1, len(organ_colors) + 1):
+        box = class_bounding_box(subsampled, class_id)
+        if box is None:
+            meshes.append(EMPTY_MESH)
+            continue
+        # padded by one voxel, so the organs are closed surfaces
+        mask = np.pad((subsampled[box] == class_id).transpose(1, 2, 0), 1)
+        verts, faces, _, _ = measure.marching_cubes(mask.astype(np.uint8), 0.5, spacing=tuple(scale))
+        verts += (np.array([box[1].start, box[2].start, box[0].start]) - 1) * scale
+        verts[:, 2] = (subsampled.shape[0] - 1) * scale[2] - verts[:, 2]  # z-flipped like mesh_volume()
+        meshes.append((verts.astype(np.float32), faces))
+    if not any(len(faces) for _, faces in meshes):
+        return
+    # the empty organs too, so every organ keeps its color and OrganN name
+    vertices_list, faces_list, colors_list = center_meshes(meshes)
+    base = os.path.splitext(combined_filename)[0] + '.preview'
+    save_as_glb(base + '.glb', vertices_list, faces_list, colors_list, config.GLB_QUANTIZE)
+    save_as_obj_with_mtl(base + '.obj', vertices_list, faces_list, colors_list, config.OBJ_DECIMALS, gzip_level=0)
+
+
+# state of the full-quality build of a rendering, in <name>.status.json next to its files, for every web worker
+# to see: 'building' (only the preview is there), then 'ready' or 'failed'. `build` tells the builds of the
+# same rendering apart.
+def status_path(combined_filename):
+    return os.path.splitext(combined_filename)[0] + '.status.json'
+
+
+def write_status(combined_filename, status, build):
+    path = status_path(combined_filename)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'status': status, 'build': build}, f)
+    os.replace(path + '.tmp', path)
+
+
+# the status of a rendering, None for the ones rendered in one go (nothing to wait for)
+def read_status(combined_filename):
+    try:
+        with open(status_path(combined_filename)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# the full builds run one after another on a background thread of the web worker (they use the mesh pool)
+_render_executor = None
+_render_executor_lock = threading.Lock()
+
+
+def get_render_executor():
+    global _render_executor
+    with _render_executor_lock:
+        if _render_executor is None:
+            _render_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='threed-render')
+        return _render_executor
+
+
+# tier 2: the full threed_render of a rendering, unless a newer build of it started in the meantime
+def _full_render(label_volume, combined_filename, organ_colors, spacing, config, build, owned):
+    if (read_status(combined_filename) or {}).get('build') != build:
+        scratch_path = _scratch_path(label_volume) if owned else None
+        if scratch_path is not None:
+            os.remove(scratch_path)
+        return
+    try:
+        threed_render(label_volume, combined_filename, organ_colors, spacing, config, owned)
+        status = 'ready'
+    except Exception:
+        traceback.print_exc()
+        status = 'failed'
+    if (read_status(combined_filename) or {}).get('build') == build:
+        write_status(combined_filename, status, build)
+
+
+# progressive rendering: the preview is written before returning, and the full-quality meshes are built in the
+# background; the render page shows the preview and swaps in the full model once the status turns 'ready'
+def threed_render_progressive(label_volume, combined_filename, organ_colors, spacing=None, config=None, owned=False):
+    config = config or MeshConfig()
+    build = os.urandom(8).hex()
+    write_status(combined_filename, 'building', build)
+    try:
+        preview_render(label_volume, combined_filename, organ_colors, spacing, config)
+    except Exception:
+        # no preview: the page waits for the full model
+        traceback.print_exc()
+    return get_render_executor().submit(_full_render, label_volume, combined_filename, organ_colors, spacing,
+                                        config, build, owned)
@@ -0,0 +1,103 @@
+import os
+import threading
+import numpy as np
+import cv2
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+
+# class for output encoding configuration
+@dataclass
+class WriterConfig:
+    NUM_WORKERS: int = 4        # threads encoding/writing frames in the background
+    QUEUE_SIZE: int = 32        # frames allowed in flight per writer before submit() blocks (backpressure)
+    OVERLAY_FORMAT: str = 'png' # 'png' or 'webp' (lossless)
+    MASK_FORMAT: str = 'png'    # 'png', 'webp' (lossless) or 'npy' (raw array)
+    WRITE_MASKS: bool = False   # also write the rgb masks (for bench.py -masks_dir); the app no longer reads them
+    PNG_COMPRESSION: int = 9    # zlib level 0-9, higher is smaller but slower (lower it to trade size for speed)
+
+
+# file extension for each supported format
+EXTENSIONS = {'png': '.png', 'webp': '.webp', 'npy': '.npy'}
+
+# encoding threads shared by every writer of the worker process
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor(num_workers=WriterConfig.NUM_WORKERS):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix='frame-writer')
+        return _executor
+
+
+# encode a frame in the requested format
+def encode_frame(frame, fmt, png_compression=WriterConfig.PNG_COMPRESSION):
+    if fmt == 'png':
+        ok, buffer = cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, png_compression])
+    elif fmt == 'webp':
+        # a quality above 100 selects lossless webp, so mask colors survive exactly
+        ok, buffer = cv2.imencode('.webp', frame, [cv2.IMWRITE_WEBP_QUALITY, 101])
+    else:
+        raise ValueError(f"Unknown image format '{fmt}'.")
+    if not ok:
+        raise IOError(f"Could not encode frame as {fmt}.")
+    return buffer.tobytes()
+
+
+# write one frame to disk; the file only appears under its final name once complete
+def write_frame(path, frame, fmt, png_compression=WriterConfig.PNG_COMPRESSION):
+    tmp_path = path + '.tmp'
+    if fmt == 'npy':
+        # store the channels in the same order cv2 puts them in an image file
+        with open(tmp_path, 'wb') as f:
+            np.save(f, frame[..., ::-1] if frame.ndim == 3 else frame)
+    else:
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_frame(frame, fmt, png_compression))
+    os.replace(tmp_path, path)
+
+
+# bounded background writer: the inference loop hands frames over and keeps computing while
+# the shared thread pool encodes and writes them. flush() is the barrier to call before anything
+# reads the files back (3D rendering, the render page).
+class FrameWriter:
+    def __init__(self, config=None):
+        self.config = config or WriterConfig()
+        self._executor = get_executor(self.config.NUM_WORKERS)
+        self._slots = threading.BoundedSemaphore(self.config.QUEUE_SIZE)
+        self._futures = []
+
+    # queue a frame for writing at `base_path` + the format's extension, returns the final path.
+    # blocks while QUEUE_SIZE frames of this writer are still pending.
+    def submit(self, base_path, frame, fmt):
+        path = base_path + EXTENSIONS[fmt]
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(write_frame, path, frame, fmt, self.config.PNG_COMPRESSION)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        return path
+
+    def submit_overlay(self, base_path, frame):
+        return self.submit(base_path, frame, self.config.OVERLAY_FORMAT)
+
+    def submit_mask(self, base_path, frame):
+        return self.submit(base_path, frame, self.config.MASK_FORMAT)
+
+    # wait until every submitted frame is on disk, re-raising the first write error
+    def flush(self):
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()